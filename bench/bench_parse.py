@@ -0,0 +1,101 @@
+##
+# Compares the fast scan of the raw XP block against the full BeautifulSoup parse of a duome.eu profile page.
+#
+# Each fixture is also measured w/ a note added to the raw block, which the fast scan gives up on, so that the cost
+#   of falling back is measured too. Fails (exit code 1) if any extractor doesn't get the same lines as the full parse.
+#
+# Run from the root of the repo:
+#   $ python bench/bench_parse.py
+#   $ python bench/bench_parse.py --rounds 500 bench/fixtures/profile.html
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+# main.py lives one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import main
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Markup in the raw block that the fast scan doesn't expect; `extract_recent()` has to fall back to the full parse
+_RAW_OPEN = '<div class="hidden" id="raw"><ul>'
+_RAW_OPEN_W_NOTE = '<div class="hidden" id="raw"><div class="note">recent</div><ul>'
+
+
+def _pages(path):
+    """
+    :param path: A saved duome.eu page
+    :return: `list` of (name, html) w/ the page as saved and, if it has a raw block, the same page w/ a note in it
+    """
+    with open(path, 'r') as f:
+        html_text = f.read()
+
+    _name = os.path.basename(path)
+    pages = [(_name, html_text)]
+    if _RAW_OPEN in html_text:
+        pages.append((_name + ' +note', html_text.replace(_RAW_OPEN, _RAW_OPEN_W_NOTE, 1)))
+    return pages
+
+
+def _measure(fn, html_text, rounds):
+    """
+    Times `rounds` calls of `fn` and then measures the peak allocation of one more call.
+
+    :param fn: The extractor to measure
+    :param html_text: The page to hand to `fn`
+    :param rounds: How many times to call `fn` for the timing
+    :return: tuple of (mean seconds per call, peak bytes allocated, the result of `fn`)
+    """
+    _start = time.perf_counter()
+    for _ in range(rounds):
+        fn(html_text)
+    _mean = (time.perf_counter() - _start) / rounds
+
+    tracemalloc.start()
+    result = fn(html_text)
+    _, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return _mean, _peak, result
+
+
+def run(paths, rounds):
+    """
+    Measures each extractor against each fixture and prints a small table.
+
+    :param paths: `list` of paths to saved duome.eu pages
+    :param rounds: How many times each extractor is called per fixture
+    :return: `True` if every extractor that didn't give up got the same lines as the full parse
+    """
+    ok = True
+    print("{:<28} {:<12} {:>12} {:>14} {:>7}".format('fixture', 'path', 'ms/call', 'peak KiB', 'items'))
+    for path in paths:
+        for page, html_text in _pages(path):
+            _expected = main._soup_raw_block(html_text)
+
+            for name, fn in (('scan', main._scan_raw_block), ('soup', main._soup_raw_block),
+                             ('extract', main.extract_recent)):
+                _mean, _peak, result = _measure(fn, html_text, rounds)
+                print("{:<28} {:<12} {:>12.3f} {:>14.1f} {:>7}".format(
+                    page, name, _mean * 1000, _peak / 1024, 'n/a' if result is None else len(result)))
+
+                # The scan may give up (that's what the fallback is for) but must never get different lines
+                if result != _expected and not (name == 'scan' and result is None):
+                    print("FAIL: {} got different lines than the full parse of {}".format(name, page))
+                    ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks extraction of the raw XP block')
+    parser.add_argument('--rounds', default=50, type=int, help="Calls per extractor per fixture")
+    parser.add_argument('fixtures', nargs='*', help="Saved duome.eu pages. Defaults to everything in bench/fixtures")
+    args = parser.parse_args()
+
+    _paths = args.fixtures or sorted(os.path.join(FIXTURES_DIR, f) for f in os.listdir(FIXTURES_DIR)
+                                     if f.endswith('.html'))
+    if not run(_paths, args.rounds):
+        sys.exit(1)
@@ -0,0 +1,122 @@
+##
+# Checks how long `import main` takes in a fresh interpreter, which is most of the cold start of the lambda and of
+#   every cron/container run. Fails (exit code 1) if the median is over budget or if any of the modules that are
+#   supposed to be imported lazily are imported at startup.
+#
+# `main.py` is compiled first so that what's measured is loading the bytecode, like a deployed package does, not
+#   compiling the source.
+#
+# Run from the root of the repo:
+#   $ python bench/bench_startup.py
+#   $ python bench/bench_startup.py --runs 30 --budget-ms 80
+
+import argparse
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Generous enough for a slow CI box; the heavy imports that were taken off the startup path cost more than this alone
+DEFAULT_BUDGET_MS = 120
+DEFAULT_RUNS = 15
+
+# Only imported by the code that needs them. If one of these shows up at startup, something imports it eagerly again
+LAZY_MODULES = ('requests', 'urllib3', 'bs4', 'asyncio', 'boto3', 'botocore', 'prettyprinter', 'email.utils',
+                'http.server', 'hmac')
+
+
+def _is_lazy(module=''):
+    """
+    :param module: A dotted module name
+    :return: `True` if `module` is, or is part of, one of the `LAZY_MODULES`
+    """
+    return any(module == m or module.startswith(m + '.') for m in LAZY_MODULES)
+
+
+def _import_times():
+    """
+    Imports `main` in a new interpreter w/ `-X importtime`.
+
+    :return: tuple of (cumulative microseconds for `main`, `list` of (cumulative microseconds, module) that `main`
+        imported itself, `set` of every module that was imported)
+    """
+    _proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT,
+                           stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # A module is listed after everything that it imported, so what `main` imported is everything listed between the
+    #   top level import before it (`site` and friends) and `main` itself
+    direct = []
+    modules = set()
+    for line in _proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, _cumulative, _name = line[len('import time:'):].split('|')
+        _depth = (len(_name) - len(_name.lstrip())) // 2
+        _name = _name.strip()
+
+        if _depth == 0:
+            if _name == 'main':
+                return int(_cumulative), direct, modules
+            direct, modules = [], set()
+            continue
+
+        modules.add(_name)
+        if _depth == 1:
+            direct.append((int(_cumulative), _name))
+
+    raise RuntimeError("`import main` wasn't in the -X importtime output")
+
+
+def run(runs=DEFAULT_RUNS, budget_ms=DEFAULT_BUDGET_MS, top=10):
+    """
+    Measures `import main` `runs` times and checks it against the budget.
+
+    :param runs: How many fresh interpreters to measure
+    :param budget_ms: The most that the median may take, in milliseconds
+    :param top: How many of the slowest direct imports to show
+    :return: `True` if startup is within budget and nothing that should be lazy was imported
+    """
+    py_compile.compile(os.path.join(ROOT, 'main.py'), doraise=True)
+
+    _totals = []
+    _direct = {}
+    _eager = set()
+    for _ in range(runs):
+        total, direct, modules = _import_times()
+        _totals.append(total / 1000)
+        for _us, name in direct:
+            _direct.setdefault(name, []).append(_us / 1000)
+        _eager |= {m for m in modules if _is_lazy(m)}
+
+    _median = statistics.median(_totals)
+    print("import main: median {:.1f}ms min {:.1f}ms max {:.1f}ms over {} runs (budget {}ms)".format(
+        _median, min(_totals), max(_totals), runs, budget_ms))
+
+    print("{:<28} {:>10}".format('slowest imports', 'median ms'))
+    _slowest = sorted(((statistics.median(v), k) for k, v in _direct.items()), reverse=True)[:top]
+    for _ms, name in _slowest:
+        print("{:<28} {:>10.1f}".format(name, _ms))
+
+    ok = True
+    if _median > budget_ms:
+        print("FAIL: import main takes {:.1f}ms, over the {}ms budget".format(_median, budget_ms))
+        ok = False
+    if _eager:
+        print("FAIL: imported at startup but should be lazy: {}".format(', '.join(sorted(_eager))))
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Checks the import time of main.py against a budget')
+    parser.add_argument('--runs', default=DEFAULT_RUNS, type=int, help="Fresh interpreters to measure")
+    parser.add_argument('--budget-ms', default=DEFAULT_BUDGET_MS, type=float, help="Max median import time")
+    parser.add_argument('--top', default=10, type=int, help="How many of the slowest imports to show")
+    args = parser.parse_args()
+
+    if not run(runs=args.runs, budget_ms=args.budget_ms, top=args.top):
+        sys.exit(1)
@@ -0,0 +1,305 @@
+##
+# End to end benchmarks of a sync against local stand-ins for duome.eu and exist.io (see `stubs.py`); nothing here
+#   talks to the real sites.
+#
+# For each number of learners, measures the latency of each call, the throughput in users/second and the peak memory
+#   allocated by `fetch_page()`, `parse_raw()`, `parse_columns()`, `do_exist_tag_update()`, `do_needful()` (one user after another) and
+#   `do_needful_many()` (all users at once, w/ a pool of workers) and `do_needful_async()` (all users at once, thru
+#   the async pipeline).
+#
+# Every result is appended to a JSON lines file along w/ the commit it was measured at; each run is compared w/ the
+#   last run of a different commit w/ the same settings so that regressions stand out.
+#
+# Run from the root of the repo:
+#   $ python bench/bench_sync.py
+#   $ python bench/bench_sync.py --learners 1 10 100 1000 --latency 0.02 --page-bytes 300000
+#   $ python bench/bench_sync.py --only fetch_page parse_raw --no-save
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# main.py lives one level up
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_HERE, '..'))
+import main
+import stubs
+
+from pytz import timezone
+
+DEFAULT_LEARNERS = (1, 10, 100, 1000)
+DEFAULT_RESULTS = os.path.join(_HERE, 'results.jsonl')
+BENCHMARKS = ('fetch_page', 'parse_raw', 'parse_columns', 'do_exist_tag_update', 'do_needful', 'do_needful_many',
+              'do_needful_async')
+
+# Every simulated learner is in the same timezone, like most real deployments
+LEARNER_TZ = 'US/Pacific'
+LEARNER_OFFSET = '-0800'
+MIN_XP = 10
+TAG = 'practice_duolingo'
+
+
+def _learners(n=1):
+    return ['learner{:04d}'.format(i) for i in range(n)]
+
+
+def _cfg(duome_url='', username=''):
+    """
+    :return: `dict` in the shape that `do_needful()` takes for one simulated learner
+    """
+    return {
+        'duolingo': {'url': duome_url + '/{username}', 'username': username, 'timezone': LEARNER_TZ, 'min_xp': MIN_XP},
+        'exist.io': {'tag': TAG, 'api_token': 'bench-{}'.format(username)}
+    }
+
+
+def _cold():
+    """
+    Forgets the primed duome.eu sessions so that each benchmark pays for priming once, like a fresh process would.
+    """
+    with main._DUOME_SESSIONS_LOCK:
+        main._DUOME_SESSIONS.clear()
+
+
+def _measure(fn, inputs=()):
+    """
+    Calls `fn` once per input, timing each call. Then does it all again under `tracemalloc` to get the peak memory
+    allocated over the whole pass; the timing pass isn't traced as tracing slows allocations down a lot.
+
+    :param fn: Called w/ each item of `inputs`
+    :param inputs: `list` of arguments for `fn`
+    :return: tuple of (`list` of seconds per call, seconds for the whole pass, peak bytes allocated)
+    """
+    _cold()
+    latencies = []
+    _start = time.perf_counter()
+    for item in inputs:
+        _t = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - _t)
+    _total = time.perf_counter() - _start
+
+    _cold()
+    tracemalloc.start()
+    for item in inputs:
+        fn(item)
+    _, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return latencies, _total, _peak
+
+
+def _summary(name='', learners=0, latencies=None, total=0.0, peak=0):
+    """
+    :return: `dict` w/ the numbers that are printed and saved for one benchmark
+    """
+    latencies = sorted(latencies or [0.0])
+
+    def _pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        'bench': name,
+        'learners': learners,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': _pct(0.50),
+        'p95_ms': _pct(0.95),
+        'max_ms': latencies[-1] * 1000,
+        'total_s': total,
+        'users_per_s': learners / total if total else 0.0,
+        'peak_kib': peak / 1024
+    }
+
+
+def run(learner_counts=DEFAULT_LEARNERS, only=BENCHMARKS, latency=0.0, page_bytes=stubs.DEFAULT_PAGE_BYTES,
+        sessions=stubs.DEFAULT_SESSIONS, workers=main.DEFAULT_MAX_WORKERS, in_flight=main.ASYNC_MAX_IN_FLIGHT,
+        stream=True):
+    """
+    Starts the stand-ins, runs each benchmark for each number of learners and stops the stand-ins.
+
+    :param learner_counts: The numbers of simulated learners to run each benchmark w/
+    :param only: The names of the benchmarks to run. See `BENCHMARKS`
+    :param latency: Seconds the stand-ins wait before answering each request
+    :param page_bytes: The size of each profile page
+    :param sessions: The number of XP sessions on each profile page
+    :param workers: Workers for `do_needful_many()`
+    :param in_flight: Requests in flight for `do_needful_async()`
+    :param stream: Passed to `fetch_page()`
+    :return: `list` of `dict`, one per benchmark per number of learners. See `_summary()`
+    """
+    _duome, duome_url = stubs.start('duome', latency=latency, page_bytes=page_bytes, sessions=sessions)
+    _exist, exist_url = stubs.start('exist', latency=latency)
+
+    # Point the exist.io client at the stand-in and lift the rate limit; it would otherwise be all that is measured
+    main.EXIST_APPEND_URL = exist_url + '/api/1/attributes/custom/append/'
+    main._EXIST_RATE_LIMITER = main._TokenBucket(rate=1e9, capacity=1e9)
+
+    _tz = timezone(LEARNER_TZ)
+    results = []
+    try:
+        for n in learner_counts:
+            _users = _learners(n)
+            _cfgs = [_cfg(duome_url, u) for u in _users]
+            _urls = [duome_url + '/' + u for u in _users]
+
+            # The later benchmarks start from what the earlier ones would have produced
+            _recent = [main.fetch_page(url=u, gmt_delta=LEARNER_OFFSET, stream=stream) for u in _urls]
+            _tags = [main._tags_for_days(main._bucket_days(main.parse_raw(r, _tz)), min_xp=MIN_XP, tag=TAG)
+                     for r in _recent]
+
+            _benches = {
+                'fetch_page': (lambda url: main.fetch_page(url=url, gmt_delta=LEARNER_OFFSET, stream=stream), _urls),
+                'parse_raw': (lambda recent: main.parse_raw(recent, _tz), _recent),
+                'parse_columns': (lambda recent: main.parse_columns(recent, _tz).totals(), _recent),
+                'do_exist_tag_update': (lambda tags: main.do_exist_tag_update(tags, api_token='bench'), _tags),
+                'do_needful': (main.do_needful, _cfgs),
+            }
+            for name in only:
+                if name in _benches:
+                    _fn, _inputs = _benches[name]
+                    results.append(_summary(name, n, *_measure(_fn, _inputs)))
+
+            # These sync every user in one call; per user latency is how long each user's phases took in the timed pass
+            _many = {'duolingo': _cfgs[0]['duolingo'], 'exist.io': _cfgs[0]['exist.io'],
+                     'users': {u: {'username': u} for u in _users}}
+            _all = {
+                'do_needful_many': lambda cfg, m: main.do_needful_many(cfg, max_workers=workers, metrics=m),
+                'do_needful_async': lambda cfg, m: main.do_needful_async(cfg, in_flight=in_flight, metrics=m),
+            }
+            for name in only:
+                if name in _all:
+                    _passes = []
+
+                    def _sync_all(cfg):
+                        _passes.append({})
+                        _all[name](cfg, _passes[-1])
+
+                    _, _total, _peak = _measure(_sync_all, [_many])
+                    _latencies = [sum(m.phases.values()) for m in _passes[0].values()]
+                    results.append(_summary(name, n, _latencies, _total, _peak))
+
+            for r in results[-len(only):]:
+                _print(r)
+    finally:
+        _duome.terminate()
+        _exist.terminate()
+
+    return results
+
+
+def _commit():
+    """
+    :return: The short hash of the checked out commit (w/ `-dirty` if tracked files were changed) or `unknown`
+    """
+    try:
+        _hash = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=_HERE,
+                                        stderr=subprocess.DEVNULL).decode().strip()
+        # Untracked files (E.G.: the results file itself) don't change what's being measured
+        _dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no', '--', '..'],
+                                         cwd=_HERE, stderr=subprocess.DEVNULL).strip()
+        return _hash + ('-dirty' if _dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _print(result=None, header=False):
+    if header:
+        print("{:<22} {:>8} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+            'bench', 'learners', 'mean ms', 'p50 ms', 'p95 ms', 'max ms', 'users/s', 'peak KiB'))
+        return
+    print("{bench:<22} {learners:>8} {mean_ms:>10.3f} {p50_ms:>10.3f} {p95_ms:>10.3f} {max_ms:>10.3f} "
+          "{users_per_s:>12.1f} {peak_kib:>12.1f}".format(**result))
+
+
+def _compare(results=None, settings=None, path=''):
+    """
+    Prints how each result differs from the last one saved in `path` from a different commit w/ the same settings.
+
+    :param results: `list` of `dict` from this run
+    :param settings: `dict` of the settings used for this run
+    :param path: The JSON lines file w/ earlier results
+    :return:
+    """
+    if not os.path.exists(path):
+        return
+
+    _commit_now = settings['commit']
+    _before = {}
+    with open(path, 'r') as f:
+        for line in f:
+            _run = json.loads(line)
+            _same = all(_run['settings'].get(k) == v for k, v in settings.items() if k not in ('commit', 'time'))
+            if not _same or _run['settings'].get('commit') == _commit_now:
+                continue
+            for r in _run['results']:
+                _before[(r['bench'], r['learners'])] = (_run['settings'].get('commit'), r)
+
+    if len(_before) < 1:
+        return
+
+    print("\nCompared w/ earlier runs w/ the same settings:")
+    print("{:<22} {:>8} {:>16} {:>14} {:>14}".format('bench', 'learners', 'vs commit', 'users/s', 'peak KiB'))
+    for r in results:
+        _old = _before.get((r['bench'], r['learners']))
+        if _old is None:
+            continue
+        _c, _r = _old
+        print("{:<22} {:>8} {:>16} {:>+13.1f}% {:>+13.1f}%".format(
+            r['bench'], r['learners'], _c,
+            (r['users_per_s'] / _r['users_per_s'] - 1) * 100 if _r['users_per_s'] else 0.0,
+            (r['peak_kib'] / _r['peak_kib'] - 1) * 100 if _r['peak_kib'] else 0.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks a sync end to end against local stand-ins')
+    parser.add_argument('--learners', nargs='+', type=int, default=list(DEFAULT_LEARNERS),
+                        help="Numbers of simulated learners to run each benchmark w/")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help="Only run these benchmarks")
+    parser.add_argument('--latency', default=0.0, type=float, help="Seconds the stand-ins wait before each response")
+    parser.add_argument('--page-bytes', default=stubs.DEFAULT_PAGE_BYTES, type=int, help="Size of each profile page")
+    parser.add_argument('--sessions', default=stubs.DEFAULT_SESSIONS, type=int, help="XP sessions per profile page")
+    parser.add_argument('--workers', default=main.DEFAULT_MAX_WORKERS, type=int,
+                        help="Workers for do_needful_many")
+    parser.add_argument('--in-flight', default=main.ASYNC_MAX_IN_FLIGHT, type=int,
+                        help="Requests in flight for do_needful_async")
+    parser.add_argument('--no-stream', action='store_true', help="Download whole pages instead of streaming them")
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help="JSON lines file to append results to")
+    parser.add_argument('--no-save', action='store_true', help="Don't save the results")
+    args = parser.parse_args()
+
+    # The per-user INFO lines would drown out the results
+    main.log.setLevel(logging.WARNING)
+
+    _settings = {
+        'commit': _commit(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'latency': args.latency,
+        'page_bytes': args.page_bytes,
+        'sessions': args.sessions,
+        'workers': args.workers,
+        'in_flight': args.in_flight,
+        'stream': not args.no_stream
+    }
+    print("commit:{commit} python:{python} latency:{latency}s page_bytes:{page_bytes} sessions:{sessions} "
+          "workers:{workers} in_flight:{in_flight} stream:{stream}\n".format(**_settings))
+
+    _print(header=True)
+    _results = run(args.learners, only=args.only, latency=args.latency, page_bytes=args.page_bytes,
+                   sessions=args.sessions, workers=args.workers, in_flight=args.in_flight,
+                   stream=not args.no_stream)
+
+    _compare(_results, _settings, args.results)
+
+    if not args.no_save:
+        with open(args.results, 'a') as f:
+            f.write(json.dumps({'settings': _settings, 'results': _results}) + "\n")
+        print("\nSaved to {}".format(args.results))
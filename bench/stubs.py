@@ -0,0 +1,236 @@
+##
+# Local stand-ins for duome.eu and exist.io so that the benchmarks never touch the real sites.
+#
+# The duome.eu stand-in follows the same flow as the real thing: the first request hands out a PHPSESSID, `tz.php`
+#   binds a timezone to it and only then does the profile page have the raw XP block. Pages are generated per user
+#   and padded out to a given size so that the cost of downloading/parsing a big page can be measured.
+#
+# The exist.io stand-in accepts every tag that is appended and answers like the real API does.
+#
+# Either can be run on its own to poke at by hand:
+#   $ python bench/stubs.py duome --port 8765 --latency 0.05 --page-bytes 150000
+#   $ python bench/stubs.py exist --port 8770
+#
+# Or started from another script w/ `start()`, which runs the server in its own process.
+
+import argparse
+import datetime
+import hashlib
+import http.cookies
+import http.server
+import json
+import multiprocessing
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+# How many XP sessions are on each generated page, and over how many days they are spread
+DEFAULT_SESSIONS = 21
+DEFAULT_DAYS = 7
+
+# Roughly the size of a real profile page
+DEFAULT_PAGE_BYTES = 150 * 1024
+
+# On the real page, the raw XP block is about 40% of the way in
+RAW_BLOCK_AT = 0.4
+
+# Used to pad the page out to size
+_FILLER_ROW = '<tr><td class="lang">Spanish</td><td>{} XP</td><td><div class="bar" style="width:9%"></div></td></tr>\n'
+
+
+def _filler(n_bytes=0):
+    """
+    Returns at least `n_bytes` of HTML that looks enough like the rest of a profile page.
+
+    :param n_bytes: How much filler is needed
+    :return: `str`
+    """
+    _rows = []
+    _size = 0
+    while _size < n_bytes:
+        _rows.append(_FILLER_ROW.format(len(_rows)))
+        _size += len(_rows[-1])
+    return '<div><table>\n' + ''.join(_rows) + '</table></div>\n'
+
+
+def make_page(username='', sessions=DEFAULT_SESSIONS, days=DEFAULT_DAYS, page_bytes=DEFAULT_PAGE_BYTES, today=None):
+    """
+    Builds a profile page for `username`. The sessions are spread over the last `days` days and the XP for each is
+    derived from the user name so that the same user always gets the same page (on the same day).
+
+    :param username: The learner the page is for
+    :param sessions: How many XP sessions to put in the raw block
+    :param days: How many days, ending today, the sessions are spread over
+    :param page_bytes: The size to pad the page out to
+    :param today: The last day w/ sessions. Defaults to today
+    :return: `str` w/ the page
+    """
+    today = today or datetime.date.today()
+    _seed = hashlib.sha1(username.encode('utf-8')).digest()
+
+    _lines = []
+    for i in range(sessions):
+        _day = today - datetime.timedelta(days=days - 1 - (i * days) // max(sessions, 1))
+        _secs = 6 * 3600 + (i * 7919 + _seed[i % len(_seed)] * 97) % (16 * 3600)
+        _when = datetime.datetime.combine(_day, datetime.time()) + datetime.timedelta(seconds=_secs)
+        _xp = 5 + _seed[(i * 3) % len(_seed)] % 40
+        _extra = ' stories / timed practice' if _seed[i % len(_seed)] % 3 == 0 else ''
+        _lines.append('<li>{} &middot; {}XP{}</li>'.format(_when.strftime('%Y-%m-%d %H:%M:%S'), _xp, _extra))
+
+    _raw = '<div class="hidden" id="raw"><ul>\n' + '\n'.join(_lines) + '\n</ul></div>\n'
+    _head = '<html><head><title>{} - duome</title></head><body>\n'.format(username)
+    _tail = '</body></html>\n'
+
+    _pad = max(page_bytes - len(_head) - len(_raw) - len(_tail), 0)
+    _before = int(_pad * RAW_BLOCK_AT)
+    return _head + _filler(_before) + _raw + _filler(_pad - _before) + _tail
+
+
+class _DuomeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers like duome.eu does. Settings are on the server object; see `serve()`.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out in separate writes; w/ Nagle on, each response would stall on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status=200, body=b'', cookie=None):
+        self.send_response(status)
+        if cookie is not None:
+            self.send_header('Set-Cookie', 'PHPSESSID={}; path=/'.format(cookie))
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        _cookies = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        _sid = _cookies['PHPSESSID'].value if 'PHPSESSID' in _cookies else None
+
+        # Unknown sessions get a new cookie; they'll need to call tz.php before they see any data
+        _new = None
+        with server.lock:
+            if _sid not in server.sessions:
+                _sid = _new = uuid.uuid4().hex
+                server.sessions[_sid] = None
+
+        _url = urllib.parse.urlsplit(self.path)
+        if _url.path == '/tz.php':
+            with server.lock:
+                server.sessions[_sid] = urllib.parse.parse_qs(_url.query).get('time', [''])[0]
+            return self._send(body=b'ok', cookie=_new)
+
+        if server.sessions.get(_sid) is None:
+            return self._send(body=b'<html><body>Please set your timezone</body></html>', cookie=_new)
+
+        _user = urllib.parse.unquote(_url.path.strip('/'))
+        _page = server.pages.get(_user)
+        if _page is None:
+            _page = server.pages[_user] = make_page(_user, sessions=server.n_sessions,
+                                                    page_bytes=server.page_bytes).encode('utf-8')
+        return self._send(body=_page, cookie=_new)
+
+
+class _ExistHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers like the exist.io append endpoint does: every tag that was sent is a success.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        _tags = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'[]')
+        _body = json.dumps({'success': _tags, 'failed': []}).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # A streaming client hangs up as soon as it has the raw XP block; that's expected, not an error
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def serve(kind='duome', port=0, latency=0.0, page_bytes=DEFAULT_PAGE_BYTES, sessions=DEFAULT_SESSIONS, ready=None):
+    """
+    Runs a stand-in server until the process is killed.
+
+    :param kind: `duome` or `exist`
+    :param port: The port to listen on. 0 picks a free one
+    :param latency: Seconds to wait before answering each request
+    :param page_bytes: duome only: the size of each profile page
+    :param sessions: duome only: the number of XP sessions on each profile page
+    :param ready: Optional connection; the port that was bound is sent on it once the server is listening
+    :return:
+    """
+    _handler = {'duome': _DuomeHandler, 'exist': _ExistHandler}[kind]
+    server = _Server(('127.0.0.1', port), _handler)
+    server.latency = latency
+    server.page_bytes = page_bytes
+    server.n_sessions = sessions
+    server.sessions = {}
+    server.pages = {}
+    server.lock = threading.Lock()
+
+    if ready is not None:
+        ready.send(server.server_address[1])
+        ready.close()
+    server.serve_forever()
+
+
+def start(kind='duome', **kwargs):
+    """
+    Starts a stand-in server in its own process so that it doesn't compete w/ the code being measured for the GIL
+    and its allocations don't show up in the client's memory numbers.
+
+    :param kind: `duome` or `exist`
+    :param kwargs: Passed to `serve()`
+    :return: tuple of (`multiprocessing.Process`, base URL of the server). Call `terminate()` on the former when done
+    """
+    _parent, _child = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=serve, args=(kind,), kwargs=dict(kwargs, ready=_child), daemon=True)
+    proc.start()
+    _child.close()
+    _port = _parent.recv()
+    return proc, 'http://127.0.0.1:{}'.format(_port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs a local stand-in for duome.eu or exist.io')
+    parser.add_argument('kind', choices=('duome', 'exist'))
+    parser.add_argument('--port', default=0, type=int, help="Port to listen on. 0 picks a free one")
+    parser.add_argument('--latency', default=0.0, type=float, help="Seconds to wait before each response")
+    parser.add_argument('--page-bytes', default=DEFAULT_PAGE_BYTES, type=int, help="duome: size of each page")
+    parser.add_argument('--sessions', default=DEFAULT_SESSIONS, type=int, help="duome: XP sessions per page")
+    args = parser.parse_args()
+
+    _proc, _url = start(args.kind, port=args.port, latency=args.latency, page_bytes=args.page_bytes,
+                        sessions=args.sessions)
+    print("{} stand-in listening on {}".format(args.kind, _url))
+    _proc.join()
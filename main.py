@@ -13,9 +13,9 @@ import logging
 # File/patch checking, env-var access
 import os
 
-# for scraping the page
-import requests
-from bs4 import BeautifulSoup
+# `requests` (for scraping the page), `bs4` (for the slow path thru it) and `asyncio` (for `--async`) are slow to
+#   import, so they are only imported by the code that needs them. Runs that don't talk to anyone, like `--help` or
+#   `--export`, never pay for them and most runs never load `bs4` at all.
 
 # For converting 'when' to a useful object
 import datetime
@@ -26,9 +26,56 @@ import json
 
 # Used for deep-merge of config docs
 import collections
+import copy
 
-# Debugging
-from prettyprinter import pprint as pp
+# Caches are shared between worker threads
+import threading
+
+# Used to time the phases of a sync
+import contextlib
+
+# Used to sync many users at once
+import concurrent.futures
+
+# For the backfill of exported history
+import csv
+
+# For remembering what was tagged in earlier runs
+import sqlite3
+import tempfile
+
+# Used to age out cached sessions
+import time
+
+# For retry/back off when talking to exist.io
+import random
+
+# For the daemon's schedule
+import heapq
+import signal
+
+# Used to find tz.php relative to the profile URL
+import urllib.parse
+
+# For the fast path thru the duome.eu page
+import html
+import re
+
+# For bucketing XP by day w/o an object per session
+import array
+import bisect
+
+# For a stable user -> shard mapping
+import hashlib
+
+# For the XP history log
+import mmap
+import struct
+
+# For record/replay cassettes
+import atexit
+import base64
+import io
 
 ###
 # Begin by configuring logging
@@ -53,286 +100,3617 @@ DEFAULT_LOG_LEVEL = 'i'
 logging.basicConfig(format=LOG_FORMAT, level=log_levels['i'])
 log = logging.getLogger(__name__)
 
-DEFAULT_SSM_PATH = '/prod/lambda/duo-to-exist/config'
+DEFAULT_SSM_PATH = '/prod/lambda/duo-to-exist/config'
+
+# When loading one config document per user from a SSM path, the document w/ this name holds the shared defaults
+SSM_DEFAULTS_NAME = '_defaults'
+
+# How long (seconds) a warm lambda can keep using the config it fetched from SSM
+DEFAULT_CFG_TTL = 5 * 60
+
+# ssm path -> (when fetched, config). See `_get_cached_cfg()`
+_CFG_CACHE = {}
+_CFG_CACHE_LOCK = threading.Lock()
+
+# SSM path -> (source key, compiled config) on lambda. See `load_cfg()`
+_CFG_SNAPSHOTS = {}
+_CFG_SNAPSHOTS_LOCK = threading.Lock()
+
+# How often (seconds) long running modes check if the config has changed
+CFG_RELOAD_INTERVAL = 60
+
+# iam profile -> SSM client. See `_get_ssm_client()`
+_SSM_CLIENTS = {}
+_SSM_CLIENTS_LOCK = threading.Lock()
+
+# When syncing many users, this is the max number that are synced at the same time
+DEFAULT_MAX_WORKERS = 8
+
+# We pretend to be a chrome browser...
+DUOME_HEADERS = {
+    'authority': 'duome.eu',
+    'pragma': 'no-cache',
+    'cache-control': 'no-cache',
+    'upgrade-insecure-requests': '1',
+    'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_2) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/78.0.3904.108 Safari/537.36',
+
+    'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,'
+              'application/signed-exchange;v=b3',
+    'sec-fetch-site': 'same-origin',
+    'sec-fetch-mode': 'navigate',
+    'accept-encoding': 'gzip, deflate, br',
+    'accept-language': 'en-US,en;q=0.9',
+}
+
+# The magic cookie needed before we can get working results
+DUOME_MAGIC_COOKIE = "PHPSESSID"
+
+# duome.eu is a PHP site; by default PHP throws away sessions that have been idle for 24 min. Stay under that so we
+#   don't re-use a session that the server has (silently) forgotten the timezone for.
+DUOME_SESSION_MAX_AGE = 20 * 60
+
+# (connect, read) timeouts for duome.eu requests, in seconds
+DUOME_TIMEOUT = (5, 20)
+
+# A session in a user's XP history log: UTC epoch, XP. See `XPLog`
+XP_LOG_RECORD = struct.Struct('<qI')
+_XP_LOG_LOCK = threading.Lock()
+
+# After this many failures in a row (connection errors, timeouts, 429s and 5xxs) a host is taken to be down and
+#   requests to it fail right away. Once the cool down has passed, one request is let thru to see if it's back.
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30
+
+# host -> circuit breaker. See `_get_breaker()`
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+# How long (seconds) to remember that a user's page can't be used (unknown user, no raw XP data) before asking again
+DUOME_NEGATIVE_TTL = 10 * 60
+
+# url -> (when it expires, the exception to raise or `None` if there was no raw XP data)
+_NEGATIVE_CACHE = {}
+_NEGATIVE_CACHE_LOCK = threading.Lock()
+
+# Used by the fast scan of the raw XP block. See `_scan_raw_block()`
+_RAW_DIV_RE = re.compile(r"""<div(?=[^>]*\bid\s*=\s*["']raw["'])"""
+                         r"""(?=[^>]*\bclass\s*=\s*["'](?P<class>[^"']*)["'])[^>]*>""", re.IGNORECASE)
+_RAW_LI_RE = re.compile(r'<li\b[^>]*>(.*?)</li\s*>', re.IGNORECASE | re.DOTALL)
+_RAW_LI_OPEN_RE = re.compile(r'<li\b', re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r'<[^>]*>')
+
+# Same as `_RAW_DIV_RE`, but for the raw bytes of a streamed page
+_RAW_DIV_BYTES_RE = re.compile(_RAW_DIV_RE.pattern.encode(), re.IGNORECASE)
+
+# How much of the streamed page to hold on to while looking for the raw block; must fit the whole opening tag
+_RAW_SCAN_TAIL = 1024
+
+# What duome.eu serves instead of the profile when the session it was sent isn't bound to a timezone
+_TZ_PROMPT_RE = re.compile(r'please\s+set\s+your\s+timezone', re.IGNORECASE)
+_TZ_PROMPT_BYTES_RE = re.compile(_TZ_PROMPT_RE.pattern.encode(), re.IGNORECASE)
+
+# Size of the chunks that a streamed page is read in
+STREAM_CHUNK_SIZE = 8 * 1024
+
+# When streaming, give up on a page that is bigger than this w/o having the raw block in it
+DEFAULT_MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+# `YYYY-MM-DD HH:MM:SS`, as shown on duome.eu
+_RAW_WHEN_RE = re.compile(r'\d{4}-\d{2}-\d{2} ([01]\d|2[0-3]):[0-5]\d:([0-5]\d|6[01])$')
+
+# Days are counted from here when bucketing XP
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# timezone name -> table of UTC offsets. See `_tz_table()`
+_TZ_TABLES = {}
+_TZ_TABLES_LOCK = threading.Lock()
+
+# host -> keep-alive session. See `_get_http_session()`
+_HTTP_SESSIONS = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+# Max connections kept open per host; enough for a worker per connection and for the async pipeline's per-host limit
+HTTP_POOL_SIZE = 32
+
+# All of the per-timezone duome.eu sessions share one pool of connections. Made when it's first needed
+_DUOME_ADAPTER = None
+
+# What every HTTP request is sent thru; `None` is the network. See `set_transport()`
+_TRANSPORT = None
+
+# Recorded bodies are stored decoded, so these no longer describe them
+_CASSETTE_SKIP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+# Request headers that are never written to a cassette
+_CASSETTE_REDACT_HEADERS = ('authorization',)
+
+# When replaying, how much faster than recorded the responses come back. 0 answers at once
+DEFAULT_REPLAY_SPEED = 1.0
+
+# tz param -> primed session. Shared by every user in the same timezone and survives warm lambda invocations
+_DUOME_SESSIONS = {}
+_DUOME_SESSIONS_LOCK = threading.Lock()
+
+# Guards read-modify-write of the on-disk cookie cache
+_COOKIE_CACHE_LOCK = threading.Lock()
+
+# When backfilling, the number of history lines that are handed to a worker process at once
+BACKFILL_CHUNK_SIZE = 10000
+
+# Lines that can't be parsed are skipped; only this many of them are logged per user, the rest are just counted
+BACKFILL_BAD_LINES_LOGGED = 20
+
+# The endpoint that custom tags are appended w/
+EXIST_APPEND_URL = 'https://exist.io/api/1/attributes/custom/append/'
+
+# The max number of tags that can be sent to exist.io in a single request
+EXIST_BATCH_SIZE = 35
+
+# (connect, read) timeouts for exist.io requests, in seconds
+EXIST_TIMEOUT = (5, 30)
+
+# How many times a request to exist.io is retried and how long to wait (seconds) between tries. The wait doubles w/
+#   each retry, unless exist.io says how long to wait w/ `Retry-After`; it never goes above the max.
+EXIST_MAX_RETRIES = 5
+EXIST_BACKOFF_BASE = 1.0
+EXIST_MAX_BACKOFF = 60.0
+
+# Requests per second to exist.io (and burst size), shared by all accounts
+EXIST_RATE_LIMIT = 5
+EXIST_RATE_BURST = 10
+
+# In daemon mode, the shortest and longest time (seconds) between polls of the same user. Near the times that a user
+#   usually practices, they are polled every `DAEMON_MIN_INTERVAL`; the rest of the day, less often.
+DAEMON_MIN_INTERVAL = 10 * 60
+DAEMON_MAX_INTERVAL = 2 * 60 * 60
+
+# Users w/ less than this many sessions on record don't have a pattern (yet); poll them every default interval
+DAEMON_MIN_HISTORY = 10
+DAEMON_DEFAULT_INTERVAL = 30 * 60
+
+# Each delay is randomly moved by up to this fraction so that users don't hit duome.eu in lock step
+DAEMON_JITTER = 0.2
+
+# Seconds of a lambda's time budget that are kept back for closing/uploading the state store and logging metrics. No
+#   new user is started unless there's at least this much, plus the time that the slowest user so far took, left.
+LAMBDA_TIME_RESERVE = 10
+
+# W/ `--serve`: the port that is listened on if only a host is given and how long (seconds) the result of a sync is
+#   handed to everyone else that asks for the same user before they are synced again
+SERVE_DEFAULT_PORT = 8080
+SERVE_RESULT_TTL = 60
+
+# Nothing is read from the body of a sync request; anything bigger than this is refused rather than drained
+SERVE_MAX_BODY = 4096
+
+# In async mode: the most requests waiting on a response at once, the most of those that go to one host and how
+#   many users can wait between two stages of the pipeline. The queues keep memory flat no matter how many users.
+ASYNC_MAX_IN_FLIGHT = 128
+ASYNC_HOST_LIMIT = HTTP_POOL_SIZE
+ASYNC_QUEUE_SIZE = 64
+
+# Used in place of a timer when metrics are off
+_NO_METRICS = contextlib.nullcontext()
+
+# Config sections that start with this are per-user. E.G.: `[user:alice]`
+USER_SECTION_PREFIX = 'user:'
+
+# Per-user sections in the INI file are flat; this maps each setting back to the section it would normally live in
+USER_KEY_SECTIONS = {
+    'url': 'duolingo',
+    'username': 'duolingo',
+    'timezone': 'duolingo',
+    'min_xp': 'duolingo',
+    'cookie_cache': 'duolingo',
+    'stream': 'duolingo',
+    'max_page_bytes': 'duolingo',
+    'history_dir': 'duolingo',
+    'api_token': 'exist.io',
+    'tag': 'exist.io',
+    'thresholds': 'exist.io'
+}
+
+
+def _to_bool(value=False):
+    """
+    INI files only have strings; turn the usual ways of writing a bool into one.
+
+    :param value: `bool` or `str`
+    :return: `bool`
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def _get_ssm_client(iam_profile=''):
+    """
+    Returns a SSM client for `iam_profile`. Clients are kept for the life of the process so that a warm lambda doesn't
+    pay to set up a boto session, credentials and a new connection on every invocation.
+
+    :param iam_profile: String. If set, will be used to configure the iam profile that the ssm client will use
+    :return: boto3 SSM client
+    """
+    with _SSM_CLIENTS_LOCK:
+        if iam_profile not in _SSM_CLIENTS:
+            import boto3
+            if iam_profile != '':
+                log.debug("creating boto session with iam_profile:%s", iam_profile)
+                # Note: You should never use AWS API keys unless you have to. And if you must use API keys, then you
+                #   should NEVER hard code them. This tool will not allow you to use API keys, so there's no risk of
+                #   hard-coding ;) Should you want to create a hard-fork, though, this is where you'd want to hard-code
+                #   in your AWS API keys.
+                session = boto3.Session(profile_name=iam_profile)
+            else:
+                session = boto3.Session()
+
+            # Get a SSM client using the session
+            _SSM_CLIENTS[iam_profile] = session.client('ssm')
+
+        return _SSM_CLIENTS[iam_profile]
+
+
+def _get_cached_cfg(ssm_path='', ttl=DEFAULT_CFG_TTL, users_path=''):
+    """
+    Returns the config document at `ssm_path`, from memory if it was fetched less than `ttl` seconds ago. A warm lambda
+    only goes back to SSM once the TTL runs out or after `invalidate_cfg_cache()`.
+
+    :param ssm_path: The full path/name to the parameter that we're to fetch
+    :param ttl: How long (seconds) a fetched config is good for. 0 disables the cache
+    :param users_path: If set, the per-user documents under this path are merged in. See `_merge_users_by_path()`
+    :return: `dict` w/ the config. Callers get their own copy, so changes to it don't leak into the cache
+    """
+    _now = time.time()
+    with _CFG_CACHE_LOCK:
+        _cached = _CFG_CACHE.get(ssm_path)
+        if _cached is not None and _cached[2] == users_path and _now - _cached[0] < ttl:
+            log.debug("Using cached config for ssm:%s (%.0fs old)", ssm_path, _now - _cached[0])
+            return copy.deepcopy(_cached[1])
+
+    _cfg = {}
+    _do_deep_merge(_cfg, _get_params_from_ssm(path=ssm_path))
+    if users_path != '':
+        _merge_users_by_path(_cfg, path=users_path)
+
+    with _CFG_CACHE_LOCK:
+        _CFG_CACHE[ssm_path] = (_now, _cfg, users_path)
+
+    return copy.deepcopy(_cfg)
+
+
+def invalidate_cfg_cache(ssm_path=None):
+    """
+    Forgets cached config documents so that the next `generate_cfg()` goes back to SSM.
+
+    :param ssm_path: The path to forget. If not set, everything is forgotten.
+    :return:
+    """
+    with _CFG_CACHE_LOCK:
+        if ssm_path is None:
+            _CFG_CACHE.clear()
+        else:
+            _CFG_CACHE.pop(ssm_path, None)
+
+
+def _get_http_session(host=''):
+    """
+    Returns the keep-alive `requests.Session` for `host`. Sessions live as long as the process does, so the TCP/TLS
+    connections in their pools are re-used by every user and by warm lambda invocations.
+
+    :param host: The host the session is for; sessions are not shared between hosts
+    :return: `requests.Session`
+    """
+    with _HTTP_SESSIONS_LOCK:
+        if host not in _HTTP_SESSIONS:
+            _HTTP_SESSIONS[host] = _new_http_session()
+        return _HTTP_SESSIONS[host]
+
+
+def _new_http_session(adapter=None):
+    """
+    :param adapter: The `HTTPAdapter` (and connection pool) to use. If not set, a new one is made.
+    :return: a `requests.Session` w/ a connection pool that is big enough for all of the worker threads
+    """
+    import requests
+    s = requests.session()
+    if adapter is None:
+        adapter = _new_adapter()
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+
+def _new_adapter():
+    """
+    :return: a new transport adapter (and connection pool) for a `requests.Session`. If a transport has been set w/
+        `set_transport()`, the adapter sends thru it
+    """
+    import requests
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE)
+    if _TRANSPORT is not None:
+        return _TRANSPORT.adapter(adapter)
+    return adapter
+
+
+def set_transport(transport=None):
+    """
+    Sends every HTTP request that is made from now on thru `transport` rather than straight to the network. Sessions
+    that were made before are dropped so that nothing keeps using the old transport.
+
+    :param transport: `CassetteRecorder`, `CassetteReplayer` or `None` to go back to the network
+    :return:
+    """
+    global _TRANSPORT, _DUOME_ADAPTER
+    with _HTTP_SESSIONS_LOCK:
+        _HTTP_SESSIONS.clear()
+    with _DUOME_SESSIONS_LOCK:
+        _DUOME_SESSIONS.clear()
+        _DUOME_ADAPTER = None
+        _TRANSPORT = transport
+
+
+def _cassette_body(body=None):
+    """
+    :param body: `bytes`, `str` or `None`
+    :return: `dict` w/ `body` as text if it is UTF-8 (so a cassette can be read by hand) or `body_b64`
+    """
+    if body is None:
+        return {'body': None}
+    if isinstance(body, str):
+        return {'body': body}
+    try:
+        return {'body': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_b64': base64.b64encode(body).decode('ascii')}
+
+
+def _cassette_bytes(entry=None):
+    """
+    :param entry: A request or response from a cassette. See `_cassette_body()`
+    :return: The body as `bytes`; empty if there wasn't one
+    """
+    if entry.get('body_b64') is not None:
+        return base64.b64decode(entry['body_b64'])
+    return (entry.get('body') or '').encode('utf-8')
+
+
+class CassetteRecorder(object):
+    """
+    A transport that sends every request for real and writes it down, along w/ the response (or the error) and how
+    long it took, as a line of JSON in a cassette file that `CassetteReplayer` can play back.
+
+    Each line has `t` (seconds from the start of the recording to the request), `method`, `url`, `request` (headers
+    and body; w/o the API token), `elapsed` (seconds until the whole response had been read) and either `status`,
+    `reason`, `headers` and the body, or the `error` that `requests` raised and its `message`.
+    """
+
+    def __init__(self, path=''):
+        self.path = path
+        self._f = open(path, 'w')
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def adapter(self, inner=None):
+        return _RecordingAdapter(self, inner)
+
+    def write(self, entry=None):
+        with self._lock:
+            self._f.write(json.dumps(entry) + '\n')
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+class _RecordingAdapter(object):
+    """
+    Sends thru the `HTTPAdapter` it wraps and hands each exchange to the `CassetteRecorder`.
+    """
+
+    def __init__(self, recorder=None, inner=None):
+        self.recorder = recorder
+        self.inner = inner
+
+    def send(self, request, **kwargs):
+        import requests
+        entry = {
+            't': round(time.monotonic() - self.recorder._start, 6),
+            'method': request.method,
+            'url': request.url,
+            'request': dict(headers={k: '<redacted>' if k.lower() in _CASSETTE_REDACT_HEADERS else v
+                                     for k, v in request.headers.items()},
+                            **_cassette_body(request.body))
+        }
+
+        _start = time.perf_counter()
+        try:
+            resp = self.inner.send(request, **kwargs)
+            # The whole body is read, even if the caller would have hung up early, so that all of it can be replayed
+            _body = resp.content
+        except requests.RequestException as e:
+            entry.update(elapsed=round(time.perf_counter() - _start, 6), error=type(e).__name__, message=str(e))
+            self.recorder.write(entry)
+            raise
+
+        entry.update(elapsed=round(time.perf_counter() - _start, 6), status=resp.status_code, reason=resp.reason,
+                     headers=[[k, v] for k, v in resp.raw.headers.iteritems()
+                              if k.lower() not in _CASSETTE_SKIP_HEADERS],
+                     **_cassette_body(_body))
+        self.recorder.write(entry)
+        return resp
+
+    def close(self):
+        self.inner.close()
+
+
+class CassetteReplayer(object):
+    """
+    A transport that never touches the network: every request is answered w/ a response from a cassette made by
+    `CassetteRecorder`, after as long as it took when it was recorded (divided by `speed`).
+
+    Requests are matched on method and URL, in the order they were recorded. Of those, one w/ the same body is
+    preferred, so that concurrent posts to exist.io get their own answers back even if they're sent in another
+    order. A request that isn't in the cassette (any more) fails like a request that couldn't connect.
+    """
+
+    def __init__(self, path='', speed=DEFAULT_REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._unused = {}
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    _entry = json.loads(line)
+                    self._unused.setdefault((_entry['method'], _entry['url']), []).append(_entry)
+        log.info("Replaying {} requests from {} {}".format(
+            sum(len(v) for v in self._unused.values()), path, "at {}x".format(speed) if speed else "w/o delays"))
+
+    def adapter(self, inner=None):
+        return _ReplayAdapter(self)
+
+    def take(self, request=None):
+        """
+        :param request: The `requests.PreparedRequest` to find an answer for
+        :return: The recorded exchange for `request` or `None` if there's none left. Each is only handed out once
+        """
+        _body = _cassette_body(request.body)
+        with self._lock:
+            _queue = self._unused.get((request.method, request.url))
+            if not _queue:
+                return None
+            for i, _entry in enumerate(_queue):
+                if _cassette_body(_entry['request'].get('body')) == _body:
+                    return _queue.pop(i)
+            return _queue.pop(0)
+
+    def close(self):
+        _left = sum(len(v) for v in self._unused.values())
+        if _left:
+            log.warning("{} recorded requests were never replayed".format(_left))
+
+
+class _ReplayedMessage(object):
+    """
+    Stands in for the `http.client.HTTPResponse` under a replayed response; `requests` takes the cookies from it.
+    """
+
+    def __init__(self, method='GET', msg=None):
+        self._method = method
+        self.msg = msg
+        self._closed = False
+
+    def isclosed(self):
+        return self._closed
+
+    def close(self):
+        self._closed = True
+
+
+class _ReplayAdapter(object):
+    """
+    Answers each request from the `CassetteReplayer`.
+    """
+
+    def __init__(self, replayer=None):
+        self.replayer = replayer
+
+    def send(self, request, **kwargs):
+        import requests
+        import urllib3
+        import http.client
+
+        entry = self.replayer.take(request)
+        if entry is None:
+            raise requests.ConnectionError("{} {} is not in the cassette".format(request.method, request.url),
+                                           request=request)
+
+        if self.replayer.speed:
+            time.sleep(entry['elapsed'] / self.replayer.speed)
+
+        if 'error' in entry:
+            _cls = getattr(requests.exceptions, entry['error'], None)
+            if not (isinstance(_cls, type) and issubclass(_cls, requests.RequestException)):
+                _cls = requests.ConnectionError
+            raise _cls(entry['message'], request=request)
+
+        _msg = http.client.HTTPMessage()
+        for k, v in entry['headers']:
+            _msg[k] = v
+        raw = urllib3.HTTPResponse(body=io.BytesIO(_cassette_bytes(entry)), headers=entry['headers'],
+                                   status=entry['status'], reason=entry['reason'], preload_content=False,
+                                   original_response=_ReplayedMessage(request.method, _msg))
+        return requests.adapters.HTTPAdapter.build_response(self, request, raw)
+
+    def close(self):
+        pass
+
+
+def _cassette_cfg(cfg=None, replay=False):
+    """
+    The config to record or replay a run w/. The cookie cache is never used: a recording always primes its own
+    duome.eu sessions, so the priming requests are in the cassette for the replay to find. A replay should also
+    neither depend on nor change what's on disk, so that it goes the same way every time.
+
+    :param cfg: `dict` w/ a compiled config
+    :param replay: If set, the state store and history logs are left out too
+    :return: a copy of `cfg` w/o the cookie caches and, for a replay, w/o the state store or history logs
+    """
+    _cfg = copy.deepcopy(cfg)
+    _keys = ('cookie_cache',)
+    if replay:
+        _cfg.pop('state', None)
+        _keys = ('cookie_cache', 'history_dir')
+    for _user in [_cfg] + list((_cfg.get('users') or {}).values()):
+        for k in _keys:
+            (_user.get('duolingo') or {}).pop(k, None)
+    return _cfg
+
+
+class _CircuitBreaker(object):
+    """
+    Keeps track of the health of one host. While the host works (closed), every request is allowed. After
+    `failures` failures in a row it opens and requests are refused w/o being tried. After `cooldown` seconds it is half
+    open: one request, the probe, is allowed. If the probe works, the breaker closes, otherwise it opens again. A probe
+    that never reports back (E.G.: the thread died) is given up on after another `cooldown`.
+    """
+
+    def __init__(self, host='', failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self._failures = failures
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened = None
+        self._probe = None
+
+    def allow(self):
+        """
+        :return: `True` if a request to the host may be made. The caller must then call `success()` or `failure()`
+        """
+        with self._lock:
+            if self._opened is None:
+                return True
+
+            _now = time.monotonic()
+            if _now - self._opened < self._cooldown:
+                return False
+            if self._probe is not None and _now - self._probe < self._cooldown:
+                return False
+
+            log.info("Circuit for %s is half open; sending a probe", self.host)
+            self._probe = _now
+            return True
+
+    def success(self):
+        with self._lock:
+            if self._opened is not None:
+                log.info("Circuit for %s is closed again", self.host)
+            self._count = 0
+            self._opened = None
+            self._probe = None
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._opened is not None or self._count >= self._failures:
+                if self._opened is None:
+                    log.warning("%s failed %s times in a row; failing requests to it for %ss", self.host,
+                                self._count, self._cooldown)
+                self._opened = time.monotonic()
+                self._probe = None
+
+
+def _get_breaker(url=''):
+    """
+    :param url: Any URL on the host
+    :return: The `_CircuitBreaker` for the host of `url`; one per host for the life of the process
+    """
+    _host = urllib.parse.urlsplit(url).hostname or ''
+    with _BREAKERS_LOCK:
+        if _host not in _BREAKERS:
+            _BREAKERS[_host] = _CircuitBreaker(host=_host)
+        return _BREAKERS[_host]
+
+
+def _guarded_get(session=None, url='', **kwargs):
+    """
+    `session.get()` w/ a timeout, behind the circuit breaker for the host. Any error from `requests` (connection
+    errors, timeouts, broken or undecodable responses, redirect loops), 429s and 5xxs count against the host; any
+    other response (including a 404) means that the host is up. Anything else that's raised leaves the breaker be.
+
+    :param session: The `requests.Session` to use
+    :param url: The URL to get
+    :param kwargs: Passed to `session.get()`
+    :return: `requests.Response`
+    :raises HostUnavailableError: if the breaker for the host is open; no request is made
+    """
+    import requests
+    breaker = _get_breaker(url)
+    if not breaker.allow():
+        raise HostUnavailableError("{} is unavailable; not trying again for a bit".format(breaker.host))
+
+    kwargs.setdefault('timeout', DUOME_TIMEOUT)
+    try:
+        resp = session.get(url, **kwargs)
+    except requests.RequestException:
+        breaker.failure()
+        raise
+
+    if resp.status_code == 429 or resp.status_code >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+    return resp
+
+
+def _negative_get(url=''):
+    """
+    :param url: The URL of a profile page
+    :return: The cache entry for `url`, tuple of (expires, `str` error or `None`), or `None` if it isn't cached
+    """
+    with _NEGATIVE_CACHE_LOCK:
+        _entry = _NEGATIVE_CACHE.get(url)
+        if _entry is not None and _entry[0] <= time.time():
+            del _NEGATIVE_CACHE[url]
+            _entry = None
+    return _entry
+
+
+def _negative_put(url='', error=None):
+    """
+    Remembers that the page at `url` can't be used, for `DUOME_NEGATIVE_TTL` seconds.
+
+    :param url: The URL of a profile page
+    :param error: Why fetching it failed (E.G.: the HTTP error) or `None` if it had no raw XP data
+    """
+    with _NEGATIVE_CACHE_LOCK:
+        _NEGATIVE_CACHE[url] = (time.time() + DUOME_NEGATIVE_TTL, error)
+
+
+def _get_params_from_ssm(path='', decrypt=True, iam_profile=''):
+    """
+    Attempts to get the document that `path` points to from Amazon Simple Systems Manager (ssm).
+    If configured, the IAM profile is also used.
+    See: https://github.com/aws/amazon-ssm-agent
+
+    :param path:    The full path/name to the parameter that we're to fetch
+    :param decrypt: Bool toggle; should the parameter at `path` be decrypted?
+    :param iam_profile: String. If set, will be used to configure the iam profile that the ssm client will use
+
+    :return:
+    """
+
+    # Get a SSM client; re-used across warm lambda invocations
+    client = _get_ssm_client(iam_profile=iam_profile)
+
+    try:
+        log.debug("Fetching Parameters from ssm:{} ...".format(path))
+        ssm_param_response = client.get_parameter(Name=path, WithDecryption=decrypt)
+
+        log.debug("got ssm data, last updated:{}".format(ssm_param_response['Parameter']['LastModifiedDate']))
+
+        # Return False to indicate that there was an error pulling the params that we expected
+        return json.loads(ssm_param_response['Parameter']['Value']) or False
+
+    except Exception as e:
+        _e = "Something broke while trying to pull values from SSM. e:{}".format(e)
+        log.error(_e)
+        raise e
+
+
+def _get_params_by_path_from_ssm(path='', decrypt=True, iam_profile='', client=None):
+    """
+    Fetches every config document under the `path` prefix w/ as few SSM round trips as possible; 10 parameters come
+    back per call of `get_parameters_by_path` rather than 1 per call of `get_parameter`.
+
+    For offline use (or tests) `path` can also be a local directory of `<name>.json` files and `client` can be any
+    object w/ a boto3 style `get_paginator()` (E.G.: a `botocore.stub.Stubber`'d or moto client).
+
+    :param path: The path prefix (E.G.: `/prod/lambda/duo-to-exist/users`) or a local directory
+    :param decrypt: Bool toggle; should the parameters be decrypted?
+    :param iam_profile: String. If set, will be used to configure the iam profile that the ssm client will use
+    :param client: SSM client to use instead of the shared one
+    :return: `dict` of name -> parsed document. The name is the part of the parameter name (or file name) after `path`
+    """
+    docs = {}
+
+    if os.path.isdir(path):
+        log.debug("Reading config documents from directory:%s ...", path)
+        for _file in sorted(os.listdir(path)):
+            _name, _ext = os.path.splitext(_file)
+            if _ext.lower() != '.json':
+                continue
+            with open(os.path.join(path, _file), 'r') as f:
+                docs[_name] = json.load(f)
+        return docs
+
+    if client is None:
+        client = _get_ssm_client(iam_profile=iam_profile)
+
+    _prefix = path.rstrip('/') + '/'
+    try:
+        log.debug("Fetching Parameters under ssm:%s ...", _prefix)
+        _pages = client.get_paginator('get_parameters_by_path').paginate(
+            Path=_prefix.rstrip('/'), Recursive=True, WithDecryption=decrypt)
+
+        for page in _pages:
+            for param in page['Parameters']:
+                _name = param['Name'][len(_prefix):] if param['Name'].startswith(_prefix) else param['Name']
+                docs[_name] = json.loads(param['Value'])
+
+    except Exception as e:
+        _e = "Something broke while trying to pull values from SSM. e:{}".format(e)
+        log.error(_e)
+        raise e
+
+    log.debug("got %s config documents from ssm", len(docs))
+    return docs
+
+
+def _merge_users_by_path(cfg=None, path='', iam_profile='', client=None):
+    """
+    Loads one config document per learner from under `path` and merges them into `cfg` as `users`. A document named
+    `SSM_DEFAULTS_NAME` holds the settings that all learners share and is merged over the top of `cfg`; each
+    learner's document is then merged over those shared defaults by `_get_users()`.
+
+    :param cfg: `dict` w/ a parsed config; updated in place
+    :param path: The path prefix or local directory. See `_get_params_by_path_from_ssm()`
+    :param iam_profile: String. If set, will be used to configure the iam profile that the ssm client will use
+    :param client: SSM client to use instead of the shared one
+    :return: `cfg`
+    """
+    docs = _get_params_by_path_from_ssm(path=path, iam_profile=iam_profile, client=client)
+
+    _do_deep_merge(cfg, docs.pop(SSM_DEFAULTS_NAME, {}))
+    _do_deep_merge(cfg, {'users': docs})
+    return cfg
+
+
+def _parse_cfg(cfg_file=''):
+    """
+    Validates file and returns an object representing the parsed content of the file
+    :param cfg_file: The path to the cfg file we're to validate and parse
+    :return: A `dict` representing the parsed config file
+    """
+    if not os.path.isfile(cfg_file):
+        _e = "The config file {} can't be accessed. Does it exist and have correct permissions?".format(cfg_file)
+        log.fatal(_e)
+        raise ConfigError(_e)
+
+    log.debug("Parsing config from {}...".format(cfg_file))
+
+    # Stand up config parser and point it @ the file...
+    cfg = configparser.ConfigParser()
+    cfg.read(cfg_file)
+
+    # Turn the entire parsed document into a dict and return to the caller
+    # Thanks to this uber elegant solution: https://stackoverflow.com/a/28990982/1521764
+    cfg = {s: dict(cfg.items(s)) for s in cfg.sections()}
+    return cfg
+
+
+class ConfigError(ValueError):
+    """
+    Raised when the config can't be used. Raised when the config is loaded, not halfway thru a run.
+    """
+
+
+def _user_tz(duo_cfg=None):
+    """
+    :param duo_cfg: The `duolingo` section of a user's config
+    :return: The user's pytz timezone; already resolved if the config was compiled. See `compile_cfg()`
+    """
+    return duo_cfg.get('tz') or timezone(duo_cfg['timezone'])
+
+
+def _compile_user(cfg=None, who='', errors=None):
+    """
+    Checks the config of one user and puts it in the form that the rest of the script uses.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param who: How to refer to the user in error messages
+    :param errors: `list` that a message for each problem is added to
+    :return: `dict` w/ the compiled `duolingo` and `exist.io` sections
+    """
+    _duo = dict(cfg.get('duolingo') or {})
+    _exist = dict(cfg.get('exist.io') or {})
+
+    for key in ('url', 'username', 'timezone'):
+        if not _duo.get(key):
+            errors.append("{}: `{}` is not set".format(who, key))
+
+    if _duo.get('timezone'):
+        try:
+            _duo['tz'] = timezone(_duo['timezone'])
+        except KeyError:
+            errors.append("{}: unknown timezone `{}`".format(who, _duo['timezone']))
+
+    if not _exist.get('api_token'):
+        errors.append("{}: no api_token. Check your config.ini and env-vars".format(who))
+
+    _min_xp_ok = True
+    if 'min_xp' in _duo:
+        try:
+            _duo['min_xp'] = int(_duo['min_xp'])
+        except (TypeError, ValueError):
+            errors.append("{}: min_xp must be a whole number, got `{}`".format(who, _duo['min_xp']))
+            _min_xp_ok = False
+
+    # Without thresholds, `min_xp`/`tag` are the one threshold
+    if _min_xp_ok or _exist.get('thresholds'):
+        try:
+            thresholds = _get_thresholds({'duolingo': _duo, 'exist.io': _exist})
+            for _min, _tag in thresholds:
+                if _tag == '':
+                    errors.append("{}: the tag for {} XP is empty".format(who, _min))
+            if _exist.get('thresholds'):
+                _exist['thresholds'] = [list(pair) for pair in thresholds]
+        except KeyError as e:
+            errors.append("{}: `{}` is not set".format(who, e.args[0]))
+        except (TypeError, ValueError) as e:
+            errors.append("{}: {}".format(who, e))
+
+    if 'stream' in _duo:
+        _duo['stream'] = _to_bool(_duo['stream'])
+    if 'max_page_bytes' in _duo:
+        try:
+            _duo['max_page_bytes'] = int(_duo['max_page_bytes'])
+        except (TypeError, ValueError):
+            errors.append("{}: max_page_bytes must be a whole number, got `{}`".format(who, _duo['max_page_bytes']))
+
+    return {'duolingo': _duo, 'exist.io': _exist}
+
+
+def compile_cfg(cfg=None):
+    """
+    Checks a whole config up front and puts it in the form that the rest of the script uses, so that a bad setting
+    stops the run before it starts rather than halfway thru a batch of users. Every user is checked and every problem
+    is reported at once.
+
+    The compiled config has the same shape as the one that went in, except:
+        - `min_xp` and `max_page_bytes` are `int`s and `stream` is a `bool`
+        - `thresholds`, if set, is a sorted list of `[min xp, tag]`
+        - each user's `duolingo` section has the resolved pytz timezone as `tz`
+        - learners from `[user:<name>]` sections and per-user documents are merged w/ the shared settings and kept,
+          whole, under `users`
+
+    Compiling a compiled config gives the same config back.
+
+    :param cfg: `dict` w/ a parsed and merged config. See `generate_cfg()`
+    :return: `dict` w/ the compiled config
+    :raises ConfigError: if anything is wrong w/ the config
+    """
+    if type(cfg) is not dict:
+        raise ConfigError("was given an invalid config. Got:`{}`".format(cfg))
+
+    _errors = []
+    users = _get_users(cfg)
+
+    compiled = {k: copy.deepcopy(v) for k, v in cfg.items() if not k.startswith(USER_SECTION_PREFIX)}
+    if len(users) > 0:
+        compiled['users'] = {name: _compile_user(_user, "user:{}".format(name), _errors)
+                             for name, _user in users.items()}
+    else:
+        compiled.update(_compile_user(cfg, "user:{}".format((cfg.get('duolingo') or {}).get('username', '')),
+                                      _errors))
+
+    if len(_errors) > 0:
+        raise ConfigError("Invalid config:\n\t{}".format("\n\t".join(_errors)))
+
+    return compiled
+
+
+def _file_stamp(path=''):
+    """
+    :return: tuple of (mtime, size) of `path` or `None` if it doesn't exist
+    """
+    try:
+        _st = os.stat(path)
+        return _st.st_mtime_ns, _st.st_size
+    except OSError:
+        return None
+
+
+def _cfg_source_key(args=None):
+    """
+    Identifies the exact version of every source that a config is built from: the mtime/size of local files and the
+    SSM version of each parameter. If the key hasn't changed, neither has the config.
+
+    :param args: The same args that `generate_cfg()` takes
+    :return: `tuple`
+    """
+    if type(args) is dict:
+        # The lambda's config is fetched at most once per TTL; the time it was fetched identifies the version
+        with _CFG_CACHE_LOCK:
+            _cached = _CFG_CACHE.get(args['ssm_path'])
+        return 'ssm', args['ssm_path'], args.get('ssm_users_path', ''), _cached[0] if _cached else None
+
+    key = [('file', args.config_file, _file_stamp(args.config_file)), ('env', os.environ.get('D2E_API_TOKEN'))]
+
+    if args.use_ssm is True:
+        _param = _get_ssm_client(iam_profile=args.iam_profile).get_parameter(Name=args.ssm_path, WithDecryption=False)
+        key.append(('ssm', args.ssm_path, _param['Parameter']['Version']))
+
+    if args.ssm_users_path != '':
+        if os.path.isdir(args.ssm_users_path):
+            key.append(('dir', args.ssm_users_path, tuple(sorted(
+                (f, _file_stamp(os.path.join(args.ssm_users_path, f))) for f in os.listdir(args.ssm_users_path)))))
+        else:
+            _pages = _get_ssm_client(iam_profile=args.iam_profile).get_paginator('describe_parameters').paginate(
+                ParameterFilters=[{'Key': 'Path', 'Option': 'Recursive', 'Values': [args.ssm_users_path.rstrip('/')]}])
+            key.append(('ssm-path', args.ssm_users_path, tuple(sorted(
+                (p['Name'], p['Version']) for page in _pages for p in page['Parameters']))))
+
+    return tuple(key)
+
+
+def load_cfg(args=None):
+    """
+    `generate_cfg()` and then `compile_cfg()`.
+
+    On lambda (`args` is a `dict`), the compiled config is kept as a snapshot for as long as the TTL cache hands out
+    the same fetch of it (see `_cfg_source_key()`), so warm invocations don't compile an unchanged config again.
+    Local files and SSM are compiled every time they're loaded; one-shot runs only load once and `_ConfigWatcher`
+    only reloads when a source has changed.
+
+    :param args: The same args that `generate_cfg()` takes
+    :return: `dict` w/ the compiled config. Callers get their own copy
+    :raises ConfigError: if anything is wrong w/ the config
+    """
+    if type(args) is not dict:
+        return compile_cfg(generate_cfg(args))
+
+    # Fetching goes thru the TTL cache, so do that first; it decides which version we have. The key comes from the
+    #   cache too, so it costs nothing
+    _cfg = generate_cfg(args)
+    _ident = args['ssm_path']
+    _key = _cfg_source_key(args)
+
+    with _CFG_SNAPSHOTS_LOCK:
+        _snap = _CFG_SNAPSHOTS.get(_ident)
+    if _snap is not None and _snap[0] == _key:
+        log.debug("Using compiled config snapshot for ssm:%s", _ident)
+        return copy.deepcopy(_snap[1])
+
+    compiled = compile_cfg(_cfg)
+    with _CFG_SNAPSHOTS_LOCK:
+        _CFG_SNAPSHOTS[_ident] = (_key, compiled)
+    return copy.deepcopy(compiled)
+
+
+class _ConfigWatcher(object):
+    """
+    Lets long running modes pick up config changes w/o a restart. `poll()` is cheap to call often; the sources are
+    only looked at every `interval` seconds and the config is only rebuilt if one of them changed. A changed config
+    that doesn't compile is logged and ignored; the one that is loaded stays in use.
+    """
+
+    def __init__(self, args=None, interval=CFG_RELOAD_INTERVAL):
+        self._args = args
+        self._interval = interval
+        self._key = _cfg_source_key(args)
+        self._checked = time.monotonic()
+
+    def poll(self):
+        """
+        :return: The new compiled config if it changed since the last call, otherwise `None`
+        """
+        _now = time.monotonic()
+        if _now - self._checked < self._interval:
+            return None
+        self._checked = _now
+
+        try:
+            _key = _cfg_source_key(self._args)
+            if _key == self._key:
+                return None
+            self._key = _key
+            cfg = load_cfg(self._args)
+        except Exception as e:
+            log.error("Config changed but can't be loaded; keeping the current one. error: {}".format(e))
+            return None
+
+        log.info("Config changed; reloaded")
+        return cfg
+
+
+def _load_cookie_cache(cookie_cache=''):
+    """
+    Reads the on-disk PHPSESSID cache. A missing or broken cache is not an error; we just prime a new session.
+
+    :param cookie_cache: Path to the JSON file w/ cached cookies. If empty, the on-disk cache is not used.
+    :return: `dict` of tz param -> {'value': ..., 'domain': ..., 'primed': epoch}
+    """
+    if cookie_cache == '' or not os.path.isfile(cookie_cache):
+        return {}
+
+    try:
+        with open(cookie_cache, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring unreadable cookie cache {}. e:{}".format(cookie_cache, e))
+        return {}
+
+
+def _save_cookie_cache(cookie_cache='', tz_param='', session=None, primed=0):
+    """
+    Adds the PHPSESSID from `session` to the on-disk cache. The file is swapped in atomically so that a crash half-way
+    thru a write can't leave a broken cache behind.
+
+    :param cookie_cache: Path to the JSON file w/ cached cookies. If empty, nothing is saved.
+    :param tz_param: The timezone string that the session has been bound to
+    :param session: The primed `requests.Session`
+    :param primed: When the session was primed (epoch)
+    :return:
+    """
+    if cookie_cache == '':
+        return
+
+    for cookie in session.cookies:
+        if cookie.name != DUOME_MAGIC_COOKIE:
+            continue
+
+        with _COOKIE_CACHE_LOCK:
+            _cache = _load_cookie_cache(cookie_cache)
+            _cache[tz_param] = {'value': cookie.value, 'domain': cookie.domain, 'primed': primed}
+
+            _tmp = "{}.tmp".format(cookie_cache)
+            try:
+                with open(_tmp, 'w') as f:
+                    json.dump(_cache, f)
+                os.replace(_tmp, cookie_cache)
+            except OSError as e:
+                log.warning("Unable to write cookie cache {}. e:{}".format(cookie_cache, e))
+        return
+
+
+def _get_duome_session(url='', tz_param='', cookie_cache='', stale=None, metrics=None):
+    """
+    Returns a `requests.Session` w/ a PHPSESSID that has been bound to `tz_param`. Sessions are shared by all users in
+    the same timezone and kept in memory (and, optionally, on disk) so that the priming round trips only happen once
+    per timezone instead of once per user per run.
+
+    :param url: The URL of the page that will be fetched w/ the session; used to get the initial cookie
+    :param tz_param: The timezone string that duome.eu expects. E.G.: `GMT -8`
+    :param cookie_cache: Path to the JSON file w/ cached cookies. If empty, only the in-memory cache is used.
+    :param stale: A session that the caller found to be stale. If it is still the cached session, a new one is primed.
+    :param metrics: Optional `SyncMetrics` to record timings in
+    :return: tuple of (`requests.Session`, bool: True if the session was just primed)
+    """
+
+    with _DUOME_SESSIONS_LOCK:
+        _entry = _DUOME_SESSIONS.setdefault(tz_param, {'session': None, 'primed': 0, 'lock': threading.Lock()})
+
+    # Only one thread per timezone gets to prime; the others wait and then use what it primed
+    with _entry['lock']:
+        _now = time.time()
+
+        if stale is not None and _entry['session'] is stale:
+            log.debug("Session for tz:%s is stale, re-priming...", tz_param)
+            _entry['session'] = None
+
+        if _entry['session'] is not None and _now - _entry['primed'] < DUOME_SESSION_MAX_AGE:
+            return _entry['session'], False
+
+        # Cookies are per timezone but every timezone shares the same pool of connections to duome.eu
+        global _DUOME_ADAPTER
+        if _DUOME_ADAPTER is None:
+            _DUOME_ADAPTER = _new_adapter()
+        s = _new_http_session(adapter=_DUOME_ADAPTER)
+
+        # If this is the first time that we've needed a session for this tz, see if one was saved by an earlier run.
+        #   Don't bother if the caller is here because the cookie we had didn't work
+        _cached = _load_cookie_cache(cookie_cache).get(tz_param) if stale is None else None
+        if _cached and _now - _cached['primed'] < DUOME_SESSION_MAX_AGE:
+            log.debug("Re-using cached session for tz:%s", tz_param)
+            s.cookies.set(DUOME_MAGIC_COOKIE, _cached['value'], domain=_cached['domain'], path='/')
+            _entry.update(session=s, primed=_cached['primed'])
+            return s, False
+
+        # Requests w/o a valid PHPSESSID/magic_cookie cookie are denied; we use Session() to manage cookies
+        # The cookie manages the time zone...
+        log.debug("Priming new session for tz:%s", tz_param)
+
+        # First, ask for *a* session cookie...
+        with _phase(metrics, 'prime'):
+            _guarded_get(s, url, headers=DUOME_HEADERS).close()
+
+        # Now that we have a session cookie, set the timezone associated w/ our session...
+        with _phase(metrics, 'tz'):
+            tz_resp = _guarded_get(s, urllib.parse.urljoin(url, '/tz.php'), params=(('time', tz_param),))
+            tz_resp.raise_for_status()
+
+        _entry.update(session=s, primed=_now)
+        _save_cookie_cache(cookie_cache, tz_param, s, _now)
+        return s, True
+
+
+class _RawBlockScanner(object):
+    """
+    Incremental version of `_scan_raw_block()`. Chunks of the page are fed in as they arrive; everything before the
+    raw block is thrown away (except for a small tail, in case the opening tag is split across chunks) so memory stays
+    small no matter how big the page is.
+
+    Once the block's closing tag has been seen, `done` is set and the caller can stop reading. If the fast scan of the
+    block fails, the caller should keep feeding the rest of the page and then call `result()` again; the BeautifulSoup
+    fallback is then run against everything from the opening tag onwards.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self._encoding = encoding
+        self._buf = b''
+        self._found = False
+        self.done = False
+        # Set if the page asked for a timezone rather than show the profile
+        self.tz_prompt = False
+
+    def feed(self, chunk=b''):
+        """
+        :param chunk: The next `bytes` of the page
+        :return: `True` if the end of the raw block has been seen
+        """
+        self._buf += chunk
+
+        if not self._found:
+            _open = _RAW_DIV_BYTES_RE.search(self._buf)
+            if _open is None:
+                self.tz_prompt = self.tz_prompt or _TZ_PROMPT_BYTES_RE.search(self._buf) is not None
+                self._buf = self._buf[-_RAW_SCAN_TAIL:]
+                return False
+            self._buf = self._buf[_open.start():]
+            self._found = True
+
+        if not self.done:
+            self.done = self._buf.find(b'</div', 4) >= 0
+
+        return self.done
+
+    def result(self, fallback=False):
+        """
+        :param fallback: If set, use the BeautifulSoup parse when the fast scan fails
+        :return: `list` of `str`, one per `<li>` or `None` if the block was not found (or could not be scanned)
+        """
+        if not self._found:
+            return None
+
+        _text = self._buf.decode(self._encoding, errors='replace')
+        recent = _scan_raw_block(_text)
+        if recent is None and fallback:
+            log.debug("Fast scan of streamed raw block failed, falling back to full parse")
+            recent = _soup_raw_block(_text)
+        return recent
+
+
+def _recent_from_chunks(chunks=(), encoding='utf-8', max_bytes=DEFAULT_MAX_PAGE_BYTES, source='', metrics=None,
+                        scanner=None):
+    """
+    Reads chunks of a page only as far as needed to get the raw XP block.
+
+    :param chunks: iterable of `bytes`; the page, in order
+    :param encoding: The encoding of the page
+    :param max_bytes: Give up if the page is bigger than this and the raw block still hasn't been seen
+    :param source: Where the page came from; only used for logging
+    :param metrics: Optional `SyncMetrics` to count downloaded bytes in
+    :param scanner: Optional `_RawBlockScanner` to read the page w/; lets the caller look at `tz_prompt` afterwards
+    :return: `list` of the raw XP lines from the page or `None` if the page didn't have any
+    """
+    if scanner is None:
+        scanner = _RawBlockScanner(encoding=encoding)
+    _read = 0
+    _draining = False
+
+    for chunk in chunks:
+        _read += len(chunk)
+        if _read > max_bytes:
+            _e = "Gave up on {} after {} bytes w/o seeing all of the raw XP block".format(source, _read)
+            raise DuomeParseError(_e)
+
+        # Keep going past the end of the block only if we need the rest of the page for the fallback
+        if scanner.feed(chunk) and not _draining:
+            if scanner.result() is not None:
+                break
+            _draining = True
+
+    log.debug("Read %s bytes of %s", _read, source)
+    _count(metrics, 'bytes_downloaded', _read)
+    return scanner.result(fallback=True)
+
+
+def _stream_recent(response=None, max_bytes=DEFAULT_MAX_PAGE_BYTES, metrics=None, scanner=None):
+    """
+    Reads a streamed (`stream=True`) response only as far as needed to get the raw XP block and then hangs up.
+
+    :param response: The `requests.Response` for the profile page
+    :param max_bytes: Give up if the page is bigger than this and the raw block still hasn't been seen. Counts the
+        bytes after they have been decompressed.
+    :param metrics: Optional `SyncMetrics` to count downloaded bytes in
+    :param scanner: Optional `_RawBlockScanner`; see `_recent_from_chunks()`
+    :return: `list` of the raw XP lines from the page or `None` if the page didn't have any
+    """
+    try:
+        return _recent_from_chunks(response.iter_content(chunk_size=STREAM_CHUNK_SIZE),
+                                   encoding=response.encoding or 'utf-8',
+                                   max_bytes=max_bytes,
+                                   source=response.url,
+                                   metrics=metrics,
+                                   scanner=scanner)
+    finally:
+        # Closing a streamed response before it has been read in full drops the connection; that's the point.
+        response.close()
+
+
+def fetch_page(url='', gmt_delta='', cookie_cache='', stream=True, max_bytes=DEFAULT_MAX_PAGE_BYTES, metrics=None,
+               page=None):
+    """
+    Takes a URL and a Timezone. Gets a session cookie, associates a timezone w/ the session
+    and then uses the session to request user data
+
+    A session that has already been associated w/ the timezone is re-used if we have one. If duome.eu doesn't accept
+    it anymore, a new session is primed and the page is fetched again.
+
+    :param url: The URL of the page to fetch.
+    :param gmt_delta:
+    :param cookie_cache: Path to a JSON file to keep session cookies in between runs. If empty, sessions are only
+        re-used for as long as this process lives.
+    :param stream: If set, the page is streamed and the download stops as soon as the raw XP block has been read.
+    :param max_bytes: When streaming, give up if this many bytes have been read w/o getting the raw XP block.
+    :param metrics: Optional `SyncMetrics` to record timings and counters in
+    :param page: Optional `dict`. If it has the `etag` and/or `last_modified` of an earlier fetch, duome.eu is asked to
+        only send the page if it has changed since. It is filled w/ the `etag` and `last_modified` of this response
+        (`None` if duome.eu didn't send them) and `not_modified`; if that's `True`, `None` is returned.
+    :return: `list` of the raw XP lines from the page or `None` if the page didn't have any. See `extract_recent()`
+    :raises DuomeParseError: if duome.eu still asks for a timezone after the session was primed again
+    """
+
+    import requests
+    log.debug("Fetching url:%s gmt_delta:%s", url, gmt_delta)
+
+    # We will get a timedelta like -0800 to indicate that we  are -08 hours and 00 min behind GMT
+    #   but the duome API will see -0800 as LITERALLY 800 hours behind GMT. Not ideal!
+    # So, we str -> int to drop the leading 0, then turn the int back into a string
+    #   and then split (at most 1  time) on the 0. Since the only 0's we have are trailing
+    #   the split will give us two tokens: the significant bits and the trailing 0's.
+    # Just toss the latter token and we have what we need:
+    #   -0800 -> -800 -> -8, 00 -> -8
+    ##
+    tz_param = "GMT {}".format(str(int(gmt_delta)).split("0", 1)[0])
+
+    # Don't bother duome.eu about a page that we recently found to be unusable
+    _cached = _negative_get(url)
+    if _cached is not None:
+        log.debug("url:%s is in the negative cache", url)
+        _count(metrics, 'negative_cache_hits')
+        if _cached[1] is not None:
+            # Every thread gets its own exception; the cache only keeps what went wrong
+            raise DuomeParseError("{} (cached)".format(_cached[1]))
+        return None
+
+    _headers = DUOME_HEADERS
+    if page is not None:
+        _headers = dict(DUOME_HEADERS)
+        if page.get('etag'):
+            _headers['If-None-Match'] = page['etag']
+        if page.get('last_modified'):
+            _headers['If-Modified-Since'] = page['last_modified']
+
+    s, fresh = _get_duome_session(url=url, tz_param=tz_param, cookie_cache=cookie_cache, metrics=metrics)
+    while True:
+        _sent = s.cookies.get(DUOME_MAGIC_COOKIE)
+
+        with _phase(metrics, 'fetch'):
+            # Now, theoretically, we have a session cookie that has been associated w/ a timezone
+            response = _guarded_get(s, url, headers=_headers, stream=stream)
+
+            if page is not None:
+                # A 304 doesn't have to repeat the validators; the ones that were sent still hold
+                page['not_modified'] = response.status_code == 304
+                if page['not_modified']:
+                    response.close()
+                    return None
+                page['etag'] = response.headers.get('ETag')
+                page['last_modified'] = response.headers.get('Last-Modified')
+
+            # If we don't get a 200, make noise. A 4xx (E.G.: no such user) won't fix itself on the next try
+            if not response.ok:
+                response.close()
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    _negative_put(url, str(e))
+                raise
+
+            # Pull the raw XP lines out of the page
+            if stream:
+                _scanner = _RawBlockScanner(encoding=response.encoding or 'utf-8')
+                recent = _stream_recent(response, max_bytes=max_bytes, metrics=metrics, scanner=_scanner)
+                _tz_prompt = _scanner.tz_prompt
+            else:
+                _text = response.text
+                _count(metrics, 'bytes_downloaded', len(response.content))
+
+        if not stream:
+            with _phase(metrics, 'parse_html'):
+                recent = extract_recent(_text)
+            _tz_prompt = recent is None and _TZ_PROMPT_RE.search(_text) is not None
+
+        # If duome.eu handed us a new session or asked for a timezone, the session we sent has expired
+        _renewed = response.cookies.get(DUOME_MAGIC_COOKIE) not in (None, _sent)
+        _tz_lost = recent is None and _tz_prompt
+        if recent is None and not (_renewed or _tz_lost):
+            # The session was fine; the page just doesn't have the data (E.G.: no such user). Leave the session be.
+            _negative_put(url)
+            return None
+
+        if fresh or not (_renewed or _tz_lost):
+            if _tz_lost:
+                _e = "duome.eu still asks for a timezone on {} w/ a freshly primed session".format(url)
+                log.error(_e)
+                raise DuomeParseError(_e)
+            return recent
+
+        log.debug("Cached session for tz:%s was not accepted (renewed:%s tz lost:%s)", tz_param, _renewed, _tz_lost)
+        s, fresh = _get_duome_session(url=url, tz_param=tz_param, cookie_cache=cookie_cache, stale=s,
+                                      metrics=metrics)
+
+
+def _scan_raw_block(html_text=''):
+    """
+    The fast path for `extract_recent()`. Rather than build a tree for the whole page, find the
+    `<div class="hidden" id="raw">` block w/ a couple of regex and pull the text out of each `<li>` in it.
+
+    The scanner only handles the simple markup that duome.eu uses for the block. If anything about the block looks off
+    (nested `<div>`, `<li>` w/o a matching `</li>`, no `hidden` class...) `None` is returned so that the caller can fall
+    back to a real HTML parser.
+
+    :param html_text: The HTML of the page
+    :return: `list` of `str`, one per `<li>` or `None` if the block could not be found or validated
+    """
+    _open = _RAW_DIV_RE.search(html_text)
+    if _open is None or 'hidden' not in _open.group('class').split():
+        return None
+
+    _close = html_text.find('</div', _open.end())
+    if _close < 0:
+        return None
+
+    _block = html_text[_open.end():_close]
+
+    # Anything that the regex can't be trusted with goes to the real parser
+    if '<div' in _block.lower():
+        return None
+
+    _items = _RAW_LI_RE.findall(_block)
+    if len(_items) != len(_RAW_LI_OPEN_RE.findall(_block)):
+        return None
+
+    return [html.unescape(_HTML_TAG_RE.sub('', item)) for item in _items]
+
+
+def _soup_raw_block(html_text=''):
+    """
+    The slow (but forgiving) path for `extract_recent()`; parse the entire page w/ BeautifulSoup.
+
+    :param html_text: The HTML of the page
+    :return: `list` of `str`, one per `<li>` or `None` if the block could not be found
+    """
+    from bs4 import BeautifulSoup
+
+    # Parse HTML and save to BeautifulSoup object¶
+    soup = BeautifulSoup(html_text, "html.parser")
+
+    # The raw data that we care about is located in
+    #   <div class="hidden" id="raw">
+    # This will be a series of 5 <li> elements, each with the most recent date + the XP level
+    raw = soup.find('div', {'class': 'hidden', 'id': 'raw'})
+    if raw is None:
+        return None
+
+    # From the RAW object, pull the list items
+    return [li.text for li in raw.find_all('li')]
+
+
+def extract_recent(html_text=''):
+    """
+    Pulls the text of each `<li>` in the `<div class="hidden" id="raw">` block out of a duome.eu profile page.
+    The fast scanner is tried first, the full BeautifulSoup parse is only done if the scanner gives up.
+
+    :param html_text: The HTML of the page
+    :return: `list` of `str` that look like `2019-12-12 16:11:48 · 13XP` or `None` if the page has no raw block
+    """
+    recent = _scan_raw_block(html_text)
+    if recent is not None:
+        return recent
+
+    log.debug("Fast scan of raw block failed, falling back to full parse")
+    return _soup_raw_block(html_text)
+
+
+def parse_raw(recent, user_tz):
+    """
+    Takes the raw XP lines (or the beautiful-soup objects they came from) and the user's TZ and returns localized
+    time + exp tuples
+
+    :param recent: `list` of `str` (see `extract_recent()`) or beautiful-soup `<li>` elements
+    :param user_tz:
+    :return:
+    """
+
+    #  Dict to store the date => XP map we'll return to the caller
+    sessions = {}
+
+    # process each raw element
+    for session in recent:
+        # Pull the text out of the HTML element
+        # It will look like this:
+        #   2019-12-12 16:11:48 · 13XP
+        #
+        # So just split on the `·` character, trim and done!
+        _raw_line = session if isinstance(session, str) else session.text
+
+        # Skip empty lines
+        if _raw_line == "":
+            continue
+
+        _tokens = _raw_line.split("·")
+
+        # Check that we have the correct number of tokens, otherwise  emit a warning and try parsing the next one...
+        if len(_tokens) != 2:
+            log.warning("unable to parse [%s]. Needed exactly 2 _tokens, but got %s. _tokens:%s",
+                        _raw_line, len(_tokens), _tokens)
+            continue
+
+        # Otherwise, assume valid split and move on to turning the _when  into a real date
+        # Note: it appears that the _when will be the time that the lesson was finished local to the user
+        #   and *not* necessarily local to the host that runs this script. This means that the script should be
+        #   run in the same time zone as the user, otherwise the definition of "day"
+        #   matter, here :)
+        ##
+        _when = _tokens[0].strip()
+        # _when will be in format `2019-12-12 16:11:48` local to  user
+        _when = datetime.datetime.strptime(_when, '%Y-%m-%d %H:%M:%S')
+        _when = user_tz.localize(_when)
+
+        # In some cases, the secnod token will be in the format of '14XP stories / timed practice' so we must
+        #   split *again* on 'XP'
+        ##
+        _xp = _tokens[1].split('XP')[0].strip()
+        _xp = int(_xp)
+
+        log.debug("earned %s on %s", _xp, _when)
+        sessions[_when] = _xp
+
+    return sessions
+
+
+def _tz_table(user_tz=None):
+    """
+    Flattens the UTC offset transitions that pytz has for a timezone into two sorted lists, once per timezone. With
+    them, turning a local wall clock time into UTC is one bisect instead of a `localize()` (and a `datetime`) per
+    session.
+
+    Like `localize()` w/o `is_dst`, a time that happens twice when the clocks go back is taken to be the second one and
+    a time that is skipped when the clocks go forward uses the offset from before the change.
+
+    :param user_tz: The user's pytz timezone
+    :return: tuple of (`list` of the local time that each offset starts at, `list` of UTC offsets), both in seconds
+    """
+    with _TZ_TABLES_LOCK:
+        _table = _TZ_TABLES.get(user_tz.zone)
+    if _table is not None:
+        return _table
+
+    _transitions = getattr(user_tz, '_utc_transition_times', None)
+    if _transitions:
+        _offsets = [int(info[0].total_seconds()) for info in user_tz._transition_info]
+        _starts = [int((when - _EPOCH).total_seconds()) + off for when, off in zip(_transitions, _offsets)]
+    else:
+        # Zones w/o any transitions (UTC, fixed offsets) only have the one offset
+        _offsets = [int(user_tz.utcoffset(_EPOCH).total_seconds())]
+        _starts = [0]
+
+    with _TZ_TABLES_LOCK:
+        _TZ_TABLES[user_tz.zone] = (_starts, _offsets)
+    return _starts, _offsets
+
+
+class XPColumns(object):
+    """
+    Sessions stored column-wise in flat arrays rather than as a `dict` of `datetime`s: the UTC epoch of each session,
+    its local wall clock time (seconds since 1970-01-01 as the user would see it; the day is `local // 86400`) and the
+    XP earned. Per-day totals are summed straight from the arrays and a day is only turned into a `YYYY-MM-DD` string
+    once, not once per session.
+
+    See `parse_columns()`.
+    """
+
+    __slots__ = ('epochs', 'local', 'xp')
+
+    def __init__(self):
+        self.epochs = array.array('q')
+        self.local = array.array('q')
+        self.xp = array.array('l')
+
+    def __len__(self):
+        return len(self.xp)
+
+    def day_totals(self):
+        """
+        :return: `dict` of day (days since 1970-01-01, local to the user) -> XP earned on that day
+        """
+        _sums = {}
+        for local, xp in zip(self.local, self.xp):
+            _day = local // 86400
+            _sums[_day] = _sums.get(_day, 0) + xp
+        return _sums
+
+    def totals(self, days=None):
+        """
+        :param days: `dict` of `YYYY-MM-DD` -> XP to add to. If not set, a new one is made
+        :return: `dict` of `YYYY-MM-DD` -> XP earned on that day. See `_bucket_days()`
+        """
+        if days is None:
+            days = {}
+        for day, xp in self.day_totals().items():
+            _day = _day_str(day)
+            days[_day] = days.get(_day, 0) + xp
+        return days
+
+    def newer_than(self, epoch=0):
+        """
+        :param epoch: UTC epoch
+        :return: `list` of the index of each session after `epoch`
+        """
+        return [i for i, when in enumerate(self.epochs) if when > epoch]
+
+    def day(self, i=0):
+        """
+        :return: `YYYY-MM-DD` of session `i`
+        """
+        return _day_str(self.local[i] // 86400)
+
+    def hour(self, i=0):
+        """
+        :return: The local hour of the day of session `i`
+        """
+        return (self.local[i] % 86400) // 3600
+
+
+def _day_str(day=0):
+    """
+    :param day: Days since 1970-01-01
+    :return: `YYYY-MM-DD`
+    """
+    return datetime.date.fromordinal(_EPOCH_ORDINAL + day).isoformat()
+
+
+def parse_columns(recent, user_tz, columns=None):
+    """
+    Same as `parse_raw()` but the sessions are appended to an `XPColumns` instead of a `dict` of `datetime`s. Times
+    are converted w/ the table from `_tz_table()`; dates are looked up once per day.
+
+    `parse_raw()` keeps the last of any sessions w/ the same time; here, only a repeat of the session right before it
+    is folded in. duome.eu lists sessions in order so, for pages, this is the same thing.
+
+    :param recent: `list` of `str` (see `extract_recent()`) or beautiful-soup `<li>` elements
+    :param user_tz: The user's pytz timezone
+    :param columns: `XPColumns` to add to. If not set, a new one is made
+    :return: `XPColumns`
+    """
+    if columns is None:
+        columns = XPColumns()
+
+    _starts, _offsets = _tz_table(user_tz)
+    _dates = {}
+    _last = None
+
+    for session in recent:
+        _raw_line = session if isinstance(session, str) else session.text
+        if _raw_line == "":
+            continue
+
+        _tokens = _raw_line.split("·")
+        if len(_tokens) != 2:
+            log.warning("unable to parse [%s]. Needed exactly 2 _tokens, but got %s. _tokens:%s",
+                        _raw_line, len(_tokens), _tokens)
+            continue
+
+        # `2019-12-12 16:11:48`, local to the user
+        _when = _tokens[0].strip()
+        if _RAW_WHEN_RE.match(_when) is None:
+            raise ValueError("time data '{}' does not match format '%Y-%m-%d %H:%M:%S'".format(_when))
+
+        _date = _when[:10]
+        _day = _dates.get(_date)
+        if _day is None:
+            _day = datetime.date(int(_date[:4]), int(_date[5:7]), int(_date[8:])).toordinal() - _EPOCH_ORDINAL
+            _dates[_date] = _day
+
+        _local = _day * 86400 + int(_when[11:13]) * 3600 + int(_when[14:16]) * 60 + int(_when[17:19])
+        _xp = int(_tokens[1].split('XP')[0].strip())
+
+        if _local == _last:
+            columns.xp[-1] = _xp
+            continue
+        _last = _local
+
+        columns.local.append(_local)
+        columns.epochs.append(_local - _offsets[max(bisect.bisect_right(_starts, _local) - 1, 0)])
+        columns.xp.append(_xp)
+
+    return columns
+
+
+class XPLog(object):
+    """
+    An append-only file w/ every session that has been seen for one user: an `XP_LOG_RECORD` (UTC epoch, XP) per
+    session, in order of time. duome.eu only shows the last 7 days; w/ the log, XP per day, streaks and what a new
+    `min_xp` would tag can be worked out for as far back as the log goes w/o asking duome.eu again.
+
+    The file is read thru `mmap`. Records are fixed width and sorted, so finding a time is a bisect over the file
+    rather than a scan. A session that is already in the log isn't added again.
+    """
+
+    def __init__(self, path=''):
+        self.path = path
+
+    def _size(self):
+        """
+        :return: The size of the log in bytes, not counting a partial record left by a write that didn't finish
+        """
+        try:
+            _size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        return _size - _size % XP_LOG_RECORD.size
+
+    def __len__(self):
+        return self._size() // XP_LOG_RECORD.size
+
+    @staticmethod
+    def _find(mm=None, n=0, epoch=0):
+        """
+        :return: The index of the first of the `n` records in `mm` that is at or after `epoch`
+        """
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if XP_LOG_RECORD.unpack_from(mm, mid * XP_LOG_RECORD.size)[0] < epoch:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, user_tz=None, since=None):
+        """
+        :param user_tz: The user's pytz timezone; used to work out the local time of each session
+        :param since: Optional UTC epoch; only sessions at or after it are read
+        :return: `XPColumns` w/ the sessions in the log
+        """
+        columns = XPColumns()
+        _size = self._size()
+        if _size < 1:
+            return columns
+
+        _starts, _offsets = _tz_table(user_tz)
+        _utc = [start - offset for start, offset in zip(_starts, _offsets)]
+
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _first = 0 if since is None else self._find(mm, _size // XP_LOG_RECORD.size, since)
+            with memoryview(mm) as _view:
+                for epoch, xp in XP_LOG_RECORD.iter_unpack(_view[_first * XP_LOG_RECORD.size:_size]):
+                    columns.epochs.append(epoch)
+                    columns.local.append(epoch + _offsets[max(bisect.bisect_right(_utc, epoch) - 1, 0)])
+                    columns.xp.append(xp)
+        return columns
+
+    def append(self, epochs=(), xp=()):
+        """
+        Adds the sessions that aren't in the log yet. New sessions are almost always newer than anything in the log
+        and are just appended; if an older one turns up, the log is rewritten in order.
+
+        :param epochs: UTC epoch of each session
+        :param xp: XP earned in each session
+        :return: The number of sessions that were added
+        """
+        _new = dict(zip(epochs, xp))
+        if len(_new) < 1:
+            return 0
+
+        with _XP_LOG_LOCK:
+            _size = self._size()
+            _n = _size // XP_LOG_RECORD.size
+            _last = None
+            if _n > 0:
+                with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    _last = XP_LOG_RECORD.unpack_from(mm, (_n - 1) * XP_LOG_RECORD.size)[0]
+
+                    # Only the part of the log that overlaps the new sessions has to be checked for repeats
+                    _first = self._find(mm, _n, min(_new))
+                    for i in range(_first, _n):
+                        _new.pop(XP_LOG_RECORD.unpack_from(mm, i * XP_LOG_RECORD.size)[0], None)
+
+            if len(_new) < 1:
+                return 0
+
+            if _last is not None and min(_new) < _last:
+                self._rewrite(_new)
+                return len(_new)
+
+            _dir = os.path.dirname(self.path)
+            if _dir != '':
+                os.makedirs(_dir, exist_ok=True)
+            with open(self.path, 'r+b' if _n > 0 else 'wb') as f:
+                f.seek(_size)
+                f.truncate()
+                f.write(b''.join(XP_LOG_RECORD.pack(epoch, _new[epoch]) for epoch in sorted(_new)))
+        return len(_new)
+
+    def _rewrite(self, new=None):
+        """
+        Writes the log again w/ the sessions in `new` merged in. The new log is written next to the old one and then
+        swapped in so that readers never see half of it.
+
+        :param new: `dict` of UTC epoch -> XP; none of them can be in the log already
+        """
+        _all = dict(new)
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as _view:
+                _all.update(XP_LOG_RECORD.iter_unpack(_view[:self._size()]))
+
+        _tmp = "{}.tmp".format(self.path)
+        with open(_tmp, 'wb') as f:
+            f.write(b''.join(XP_LOG_RECORD.pack(epoch, _all[epoch]) for epoch in sorted(_all)))
+        os.replace(_tmp, self.path)
+
+
+def _history_log(cfg=None):
+    """
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :return: The `XPLog` for the user in `cfg` or `None` if there's no `history_dir`
+    """
+    _duo_cfg = cfg['duolingo']
+    _dir = _duo_cfg.get('history_dir', '')
+    if _dir == '':
+        return None
+    return XPLog(os.path.join(_dir, "{}.xpl".format(urllib.parse.quote(_duo_cfg['username'], safe=''))))
+
+
+def _record_history(cfg=None, sessions=None, metrics=None):
+    """
+    Adds the sessions from a sync to the user's XP history log, if they have one.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param sessions: `XPColumns` w/ the sessions from the page
+    :param metrics: Optional `SyncMetrics` to record timings and counters in
+    :return:
+    """
+    _log = _history_log(cfg)
+    if _log is None:
+        return
+    with _phase(metrics, 'history'):
+        _count(metrics, 'sessions_logged', _log.append(sessions.epochs, sessions.xp))
+
+
+def _streaks(days=None, min_xp=0):
+    """
+    :param days: `dict` of day (days since 1970-01-01) -> XP
+    :param min_xp: The XP that a day needs to count
+    :return: `list` of (first day, last day) of each run of days in a row that have at least `min_xp`, oldest first
+    """
+    streaks = []
+    for day in sorted(day for day, xp in days.items() if xp >= min_xp):
+        if streaks and streaks[-1][1] == day - 1:
+            streaks[-1] = (streaks[-1][0], day)
+        else:
+            streaks.append((day, day))
+    return streaks
+
+
+def history_report(cfg=None):
+    """
+    Works out, per user, what is in their XP history log: the days and XP in it, their longest and current streaks
+    and how many days each of their thresholds tags. All of it comes from the log; nothing is fetched.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :return: `dict` of user name -> `dict` w/ the report or `None` if they don't have a log
+    """
+    users = _get_users(cfg) or {cfg['duolingo']['username']: cfg}
+
+    report = {}
+    for name, _cfg in users.items():
+        _log = _history_log(_cfg)
+        if _log is None:
+            report[name] = None
+            continue
+
+        # Days are in the user's timezone, so "today" has to be as well
+        _tz = _user_tz(_cfg['duolingo'])
+        _today = datetime.datetime.now(_tz).date().toordinal() - _EPOCH_ORDINAL
+        sessions = _log.read(_tz)
+        _days = sessions.day_totals()
+        thresholds = _get_thresholds(_cfg)
+        _streak = [b - a + 1 for a, b in _streaks(_days, thresholds[0][0])]
+        _current = _streaks(_days, thresholds[0][0])[-1:] or [(0, -2)]
+
+        report[name] = {
+            'sessions': len(sessions),
+            'days': len(_days),
+            'xp': sum(_days.values()),
+            'first_day': _day_str(min(_days)) if _days else None,
+            'last_day': _day_str(max(_days)) if _days else None,
+            'longest_streak': max(_streak, default=0),
+            # A streak is still current if the last day in it is today or yesterday
+            'current_streak': _current[0][1] - _current[0][0] + 1 if _current[0][1] >= _today - 1 else 0,
+            'tagged_days': {tag: sum(1 for xp in _days.values() if xp >= min_xp) for min_xp, tag in thresholds}
+        }
+    return report
+
+
+def _bucket_days(sessions=None, days=None):
+    """
+    Go through each session to figure out how much XP the user earned on each day. Sessions are already localized to
+    the user's timezone so the day is the date that the user would see.
+
+    :param sessions: `dict` of localized `datetime` -> XP. See `parse_raw()`
+    :param days: `dict` of day -> XP to add to. If not set, a new one is made
+    :return: `dict` of `YYYY-MM-DD` -> XP earned on that day
+    """
+    if days is None:
+        days = {}
+
+    for record in sessions or {}:
+        _x = sessions[record]
+        _day = record.strftime('%Y-%m-%d')
+        days.setdefault(_day, 0)
+        days[_day] += _x
+
+    return days
+
+
+def _add_days(days=None, more=None):
+    """
+    Adds the per-day XP in `more` to `days`.
+
+    :param days: `dict` of `YYYY-MM-DD` -> XP that is updated
+    :param more: `dict` of `YYYY-MM-DD` -> XP to add to `days`
+    :return: `days`
+    """
+    for day, xp in (more or {}).items():
+        days[day] = days.get(day, 0) + xp
+    return days
+
+
+def _get_thresholds(cfg=None):
+    """
+    Works out which tags a user gets for how much XP. By default, that is just `tag` for `min_xp`. W/ `thresholds`,
+    each tag has its own minimum; a day gets every tag whose minimum it meets.
+
+    In the INI file, `thresholds` is a comma separated list of `<min xp>:<tag>`. E.G.:
+        `thresholds=10:practice_duolingo,50:duolingo_grind`
+    In a JSON config, it can also be an object of `{"<min xp>": "<tag>"}` or a list of `[<min xp>, "<tag>"]` pairs.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :return: `list` of (min XP, tag) tuples, sorted by XP
+    """
+    _raw = cfg['exist.io'].get('thresholds') or ''
+    if _raw == '':
+        return [(int(cfg['duolingo']['min_xp']), cfg['exist.io']['tag'])]
+
+    if isinstance(_raw, str):
+        _pairs = [pair.split(':', 1) for pair in _raw.split(',') if pair.strip() != '']
+    elif isinstance(_raw, collections.abc.Mapping):
+        _pairs = list(_raw.items())
+    else:
+        _pairs = list(_raw)
+
+    thresholds = []
+    for pair in _pairs:
+        try:
+            _xp, _tag = pair
+            thresholds.append((int(_xp), str(_tag).strip()))
+        except (TypeError, ValueError):
+            _e = "Invalid XP threshold `{}`; expected `<min xp>:<tag>`. Got thresholds:`{}`".format(pair, _raw)
+            raise ValueError(_e)
+
+    return sorted(thresholds)
+
+
+def _tags_for_days(days=None, min_xp=0, tag='', log_level=logging.INFO, thresholds=None):
+    """
+    Now that we have a cumulative XP per day, see which thresholds each day's sum is above. The thresholds are sorted
+    so that one bisect per day finds all of the tags it has earned.
+
+    :param days: `dict` of `YYYY-MM-DD` -> XP. See `_bucket_days()`
+    :param min_xp: The minimum XP in a day for the day to be tagged. Ignored if `thresholds` is given
+    :param tag: The tag to apply. Ignored if `thresholds` is given
+    :param log_level: The level to log each tagged day at
+    :param thresholds: `list` of (min XP, tag). See `_get_thresholds()`
+    :return: `list` of exist.io tag payloads
+    """
+    thresholds = sorted(thresholds) if thresholds else [(int(min_xp), tag)]
+    _mins = [_min for _min, _ in thresholds]
+
+    tags = []
+    for day, xp in (days or {}).items():
+        for _min, _tag in thresholds[:bisect.bisect_right(_mins, xp)]:
+            log.log(log_level, "on %s, you managed to practice enough for %s (%s XPs)!", day, _tag, xp)
+            tags.append(_do_exist_tag_update_payload(day, tag=_tag))
+    return tags
+
+
+def _days_by_tag(tags=None, days=None):
+    """
+    :param tags: `list` of tag payloads that were applied
+    :param days: `dict` of `YYYY-MM-DD` -> XP
+    :return: `dict` of tag -> `dict` of `YYYY-MM-DD` -> XP for each day that the tag was applied to
+    """
+    by_tag = {}
+    for tag in tags or []:
+        if tag['date'] in days:
+            by_tag.setdefault(tag['value'], {})[tag['date']] = days[tag['date']]
+    return by_tag
+
+
+class DeferredError(Exception):
+    """
+    Recorded for a user that wasn't synced in this run, but isn't broken either; they should be tried again next run
+    """
+    pass
+
+
+class HostUnavailableError(DeferredError):
+    """
+    Raised when a request isn't made because the circuit breaker for the host is open
+    """
+    pass
+
+
+class DuomeParseError(Exception):
+    """
+    Raised by `sync_user()` when the duome.eu profile page doesn't have the raw XP data on it.
+    """
+    pass
+
+
+class ExistUpdateError(Exception):
+    """
+    Raised by `sync_user()` when the exist.io API refuses (or can't be reached for) a tag update.
+    """
+    pass
+
+
+class SyncMetrics(object):
+    """
+    Where the time goes in a sync of one user, plus a few counters. Phases are timed w/ `phase()`; anything that runs
+    more than once (E.G.: re-priming a session) adds up.
+
+    Phases: `prime` (getting a session cookie), `tz` (binding it to a timezone w/ tz.php), `fetch` (getting the profile
+    page; when streaming, this includes scanning it for the raw XP block), `parse_html` (pulling the raw XP block out
+    of a page that was not streamed), `parse_raw`, `post` (the exist.io update)
+
+    Counters: `bytes_downloaded`, `sessions_parsed`, `days_tagged`, `exist_requests`, `retries`
+    """
+
+    def __init__(self, user=''):
+        self.user = user
+        self.phases = {}
+        self.counters = {}
+        self.ok = None
+
+    @contextlib.contextmanager
+    def phase(self, name=''):
+        _start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - _start
+
+    def count(self, name='', n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        return {'user': self.user, 'ok': self.ok, 'phases': self.phases, 'counters': self.counters}
+
+
+def _phase(metrics=None, name=''):
+    """
+    :param metrics: `SyncMetrics` or `None` if metrics are off
+    :param name: The phase to time
+    :return: A context manager that times `name`, or does nothing at all if metrics are off
+    """
+    if metrics is None:
+        return _NO_METRICS
+    return metrics.phase(name)
+
+
+def _count(metrics=None, name='', n=1):
+    """
+    :param metrics: `SyncMetrics` or `None` if metrics are off
+    :param name: The counter to add to
+    :param n: How much to add
+    """
+    if metrics is not None:
+        metrics.count(name, n)
+
+
+def write_metrics(metrics=None, path=''):
+    """
+    Writes the metrics of a run to `path`. If `path` ends in `.prom` the Prometheus text format is used (suitable for
+    node_exporter's textfile collector) otherwise it's a JSON summary. Either way the file is swapped in atomically so
+    a scrape never sees a half written file.
+
+    :param metrics: `dict` of user -> `SyncMetrics`
+    :param path: Where to write the metrics
+    :return:
+    """
+    metrics = metrics or {}
+
+    def _label(value=''):
+        # Label values are quoted; backslashes, quotes and newlines in them have to be escaped
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    if path.endswith('.prom'):
+        _lines = [
+            "# HELP duo2exist_phase_seconds Time spent in each phase of the last sync of a user",
+            "# TYPE duo2exist_phase_seconds gauge",
+        ]
+        for name, m in sorted(metrics.items()):
+            for phase, seconds in sorted(m.phases.items()):
+                _lines.append('duo2exist_phase_seconds{{user="{}",phase="{}"}} {:.6f}'.format(
+                    _label(name), _label(phase), seconds))
+
+        for counter in sorted({c for m in metrics.values() for c in m.counters}):
+            _lines.append("# TYPE duo2exist_{} gauge".format(counter))
+            for name, m in sorted(metrics.items()):
+                _lines.append('duo2exist_{}{{user="{}"}} {}'.format(counter, _label(name), m.counters.get(counter, 0)))
+
+        _lines.append("# TYPE duo2exist_sync_success gauge")
+        for name, m in sorted(metrics.items()):
+            _lines.append('duo2exist_sync_success{{user="{}"}} {}'.format(_label(name), 1 if m.ok else 0))
+
+        _lines.append("# TYPE duo2exist_last_run_timestamp_seconds gauge")
+        _lines.append("duo2exist_last_run_timestamp_seconds {:.0f}".format(time.time()))
+        _body = "\n".join(_lines) + "\n"
+    else:
+        _body = json.dumps({'time': time.time(), 'users': [m.as_dict() for _, m in sorted(metrics.items())]})
+
+    _tmp = "{}.tmp".format(path)
+    with open(_tmp, 'w') as f:
+        f.write(_body)
+    os.replace(_tmp, path)
+
+
+@contextlib.contextmanager
+def _profiling(path='', malloc_top=0):
+    """
+    Profiles what runs inside of it.
+
+    :param path: If set, cProfile stats for every thread are written here; read them w/ `python -m pstats <path>`
+    :param malloc_top: If set, the peak memory use is logged along w/ the lines that had the most allocated at the end
+    :return:
+    """
+    import sys
+    _profiles = []
+    if path:
+        import cProfile
+        _profiles.append(cProfile.Profile())
+        if sys.version_info < (3, 12):
+            # A profiler only sees the thread that started it, so every new (worker) thread gets its own
+            def _start_thread(*_):
+                _p = cProfile.Profile()
+                _profiles.append(_p)
+                _p.enable()
+            threading.setprofile(_start_thread)
+        _profiles[0].enable()
+    if malloc_top:
+        import tracemalloc
+        tracemalloc.start()
+
+    try:
+        yield
+    finally:
+        if malloc_top:
+            _snapshot = tracemalloc.take_snapshot()
+            _, _peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            log.info("Peak memory traced: {:.1f} KiB. Most allocated by:".format(_peak / 1024))
+            for _stat in _snapshot.statistics('lineno')[:malloc_top]:
+                log.info("\t{}".format(_stat))
+
+        if path:
+            import pstats
+            threading.setprofile(None)
+            for _p in _profiles:
+                _p.disable()
+            _stats = pstats.Stats(*_profiles)
+            _stats.dump_stats(path)
+            log.info("Wrote profile of {} threads to {}".format(len(_profiles), path))
+
+
+def _log_metrics(metrics=None):
+    """
+    Logs one JSON object per user; CloudWatch Logs Insights can query these w/o any parsing rules.
+
+    :param metrics: `dict` of user -> `SyncMetrics`
+    :return:
+    """
+    for name, m in sorted((metrics or {}).items()):
+        log.info("%s", json.dumps(dict(m.as_dict(), metric='duo2exist_sync')))
+
+
+class StateStore(object):
+    """
+    A small SQLite database that remembers, per user, which days have already been tagged and the newest session that
+    has been seen. With it, a sync only looks at sessions that are new since the last run and only posts days that
+    haven't been tagged yet; in steady state, most runs don't need to talk to exist.io at all.
+
+    The path can be a local file or an `s3://bucket/key` URL. For S3 (read: lambda, where only /tmp is writable) the
+    database is downloaded to /tmp when opened and uploaded again by `close()`. Concurrent runs that share an S3 path
+    will overwrite each other's updates; at worst this means a day is tagged twice, which exist.io doesn't mind.
+    """
+
+    def __init__(self, path=''):
+        self._s3 = None
+        self._local = path
+
+        if path.startswith('s3://'):
+            _bucket, _, _key = path[len('s3://'):].partition('/')
+            self._s3 = (_bucket, _key)
+            self._local = os.path.join(tempfile.gettempdir(), "duo-to-exist-{}".format(os.path.basename(_key)))
+            self._download()
+
+        log.debug("Opening state store %s (local:%s)", path, self._local)
+
+        # Users may be synced from many threads; sqlite3 serializes access to the connection but we also need to keep
+        #   read-modify-write sequences together
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self._local, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS tagged_days (
+                user TEXT NOT NULL, tag TEXT NOT NULL, day TEXT NOT NULL, xp INTEGER NOT NULL,
+                PRIMARY KEY (user, tag, day));
+            CREATE TABLE IF NOT EXISTS cursors (
+                user TEXT NOT NULL PRIMARY KEY, last_seen REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS practice_hours (
+                user TEXT NOT NULL, hour INTEGER NOT NULL, sessions INTEGER NOT NULL,
+                PRIMARY KEY (user, hour));
+            CREATE TABLE IF NOT EXISTS page_versions (
+                user TEXT NOT NULL PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT, settings TEXT);
+        """)
+        # Databases from before `settings` was kept need the column added
+        if 'settings' not in [_col[1] for _col in self._db.execute("PRAGMA table_info(page_versions)")]:
+            with self._db:
+                self._db.execute("ALTER TABLE page_versions ADD COLUMN settings TEXT")
+
+    def _s3_client(self):
+        import boto3
+        return boto3.Session().client('s3')
+
+    def _download(self):
+        """
+        Pulls the database down from S3. A missing object is fine; we start over w/ an empty database.
+        """
+        _bucket, _key = self._s3
+        try:
+            self._s3_client().download_file(_bucket, _key, self._local)
+        except Exception as e:
+            log.warning("Unable to download state from s3://{}/{}, starting fresh. e:{}".format(_bucket, _key, e))
+
+    def last_seen(self, user=''):
+        """
+        :param user: The duolingo user name
+        :return: epoch of the newest session seen for `user` or 0 if there is none
+        """
+        with self._lock:
+            _row = self._db.execute("SELECT last_seen FROM cursors WHERE user = ?", (user,)).fetchone()
+        return _row[0] if _row else 0
+
+    def tagged(self, user='', tag=''):
+        """
+        :param user: The duolingo user name
+        :param tag: The exist.io tag
+        :return: `set` of `YYYY-MM-DD` days that `tag` has already been applied to for `user`
+        """
+        with self._lock:
+            _rows = self._db.execute("SELECT day FROM tagged_days WHERE user = ? AND tag = ?", (user, tag))
+            return {row[0] for row in _rows}
+
+    def practice_hours(self, user=''):
+        """
+        :param user: The duolingo user name
+        :return: `list` of 24 session counts; how often `user` has practiced in each (local) hour of the day
+        """
+        hours = [0] * 24
+        with self._lock:
+            for hour, sessions in self._db.execute("SELECT hour, sessions FROM practice_hours WHERE user = ?",
+                                                   (user,)):
+                hours[hour] = sessions
+        return hours
+
+    def page_version(self, user=''):
+        """
+        :param user: The duolingo user name
+        :return: `dict` w/ the `etag`, `last_modified`, `digest` and `settings` of the last page that was fully synced
+            for `user`. Empty if there isn't one
+        """
+        with self._lock:
+            _row = self._db.execute("SELECT etag, last_modified, digest, settings FROM page_versions WHERE user = ?",
+                                    (user,)).fetchone()
+        return dict(zip(('etag', 'last_modified', 'digest', 'settings'), _row)) if _row else {}
+
+    def record_page(self, user='', etag=None, last_modified=None, digest=None, settings=None, **_):
+        """
+        Remembers the version of the page that was just synced for `user`. Only call this once everything on the page
+        has been dealt w/; if the same page comes back, it is skipped.
+
+        :param user: The duolingo user name
+        :param etag: The `ETag` that duome.eu sent w/ the page, if any
+        :param last_modified: The `Last-Modified` that duome.eu sent w/ the page, if any
+        :param digest: See `_page_digest()`
+        :param settings: See `_settings_digest()`
+        :return:
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO page_versions (user, etag, last_modified, digest, settings) "
+                             "VALUES (?, ?, ?, ?, ?)", (user, etag, last_modified, digest, settings))
+
+    def record(self, user='', tag='', days=None, last_seen=None, hours=None):
+        """
+        Remembers that `days` have been tagged and, optionally, moves the session cursor forward.
+
+        :param user: The duolingo user name
+        :param tag: The exist.io tag
+        :param days: `dict` of `YYYY-MM-DD` -> XP that were tagged
+        :param last_seen: epoch of the newest session seen. If not set, the cursor is not touched.
+        :param hours: `list` of the (local) hour of each new session. Only counted if the cursor is moved, so that
+            the same session is never counted twice.
+        :return:
+        """
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO tagged_days (user, tag, day, xp) VALUES (?, ?, ?, ?)",
+                                 [(user, tag, day, xp) for day, xp in (days or {}).items()])
+            if last_seen is not None:
+                self._db.execute("INSERT OR REPLACE INTO cursors (user, last_seen) VALUES (?, MAX(?, "
+                                 "COALESCE((SELECT last_seen FROM cursors WHERE user = ?), 0)))",
+                                 (user, last_seen, user))
+                # No UPSERT; the sqlite that ships w/ some lambda runtimes is too old for it
+                for hour in hours or []:
+                    self._db.execute("INSERT OR IGNORE INTO practice_hours (user, hour, sessions) VALUES (?, ?, 0)",
+                                     (user, hour))
+                    self._db.execute("UPDATE practice_hours SET sessions = sessions + 1 WHERE user = ? AND hour = ?",
+                                     (user, hour))
+
+    def close(self):
+        """
+        Closes the database and, if it lives in S3, uploads it.
+        """
+        with self._lock:
+            self._db.close()
+
+        if self._s3 is not None:
+            _bucket, _key = self._s3
+            log.debug("Uploading state to s3://%s/%s", _bucket, _key)
+            self._s3_client().upload_file(self._local, _bucket, _key)
+
+
+def _open_state(cfg=None):
+    """
+    Opens the state store named in the `[state]` section of the config, if there is one.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :return: `StateStore` or `None` if no state store is configured
+    """
+    _path = ((cfg or {}).get('state') or {}).get('path', '')
+    if _path == '':
+        return None
+    return StateStore(_path)
+
+
+def _page_digest(recent=None, thresholds=None):
+    """
+    :param recent: `list` of the raw XP lines from a page
+    :param thresholds: The user's thresholds. See `_get_thresholds()`
+    :return: A hash of the lines and what they would be tagged w/. If it's the same as last time, there's nothing to do
+    """
+    _h = hashlib.sha1()
+    for line in recent:
+        _h.update(line.encode('utf-8'))
+        _h.update(b'\n')
+    _h.update(repr(thresholds).encode('utf-8'))
+    return _h.hexdigest()
+
+
+def _settings_digest(thresholds=None):
+    """
+    :param thresholds: The user's thresholds. See `_get_thresholds()`
+    :return: A hash of what a page would be tagged w/. duome.eu can only say whether the page has changed; if this has
+        changed too, the page has to be looked at again anyway
+    """
+    return hashlib.sha1(repr(thresholds).encode('utf-8')).hexdigest()
+
+
+def _remember_page(cfg=None, state=None, page=None):
+    """
+    Records the version of the page that was just synced so that an unchanged page is skipped next time.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param state: Optional `StateStore`
+    :param page: `dict` that `_sync_fetch()` filled in
+    :return:
+    """
+    if state is not None and page:
+        state.record_page(cfg['duolingo']['username'], **page)
+
+
+def _sync_fetch(cfg=None, metrics=None, state=None, page=None):
+    """
+    The first step of `sync_user()`: check the config and fetch the raw XP lines from duome.eu.
+
+    W/ a state store, the page is compared to the last one that was fully synced: by `ETag`/`Last-Modified` if
+    duome.eu sends them, otherwise by `_page_digest()`. If it hasn't changed, there's nothing else to do. The
+    validators are only sent if the thresholds are the same as when that page was synced; otherwise the page is
+    fetched in full so that it can be tagged w/ the new ones.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param metrics: Optional `SyncMetrics` to record timings and counters in
+    :param state: Optional `StateStore`
+    :param page: Optional `dict`; filled w/ the version of the page. Hand it to `_remember_page()` once the page has
+        been dealt w/
+    :return: `list` of the raw XP lines. See `fetch_page()`. `None` if the page hasn't changed
+    """
+
+    # First, make sure that we have a valid CFG.
+    if cfg is None:
+        cfg = dict()
+    if type(cfg) is not dict or 'exist.io' not in cfg:
+        _e = "was given an invalid config file. Got:`{}`".format(cfg)
+        raise ValueError(_e)
+    ##
+    # Otherwise, cfg should look like this:
+
+    ##
+    _duo_cfg = cfg['duolingo']
+    _exist_cfg = cfg['exist.io']
+
+    if not _exist_cfg.get('api_token'):
+        _e = "No api_token for duolingo user:{}. Check your config.ini and env-vars".format(_duo_cfg.get('username'))
+        raise ValueError(_e)
+
+    # Bad thresholds are a config problem; find out before talking to anybody
+    _thresholds = _get_thresholds(cfg)
+
+    # Localize now() to user time zone, then figure out how far it is from GMT.
+    _now = datetime.datetime.now()
+    _now = _user_tz(_duo_cfg).localize(_now)
+    _offset = _now.strftime('%z')
+
+    log.debug("_now:%s", _now)
+    log.debug("_offset:%s", _offset)
+
+    # Build a url from the user name
+    _url = _duo_cfg['url'].format(username=_duo_cfg['username'])
+
+    _last = {}
+    if state is not None:
+        _last = state.page_version(_duo_cfg['username'])
+    if page is None:
+        page = {}
+    page.update(etag=None, last_modified=None, settings=_settings_digest(_thresholds))
+    if _last.get('settings') == page['settings']:
+        page.update(etag=_last.get('etag'), last_modified=_last.get('last_modified'))
+
+    # Pass the URL to fetcher; include time zone so service knows how to localize data for us... (REQUIRED!)
+    _recent = fetch_page(url=_url, gmt_delta=_offset,
+                         cookie_cache=_duo_cfg.get('cookie_cache', ''),
+                         stream=_to_bool(_duo_cfg.get('stream', True)),
+                         max_bytes=int(_duo_cfg.get('max_page_bytes', DEFAULT_MAX_PAGE_BYTES)),
+                         metrics=metrics, page=page)
+    if page.pop('not_modified', False):
+        log.info("Page for user:{} not modified; nothing to do".format(_duo_cfg['username']))
+        _count(metrics, 'pages_unchanged')
+        return None
+    if _recent is None:
+        _e = "No raw XP data on {}. Does the user exist?".format(_url)
+        raise DuomeParseError(_e)
+
+    page['digest'] = _page_digest(_recent, _thresholds)
+    if _last.get('digest') == page['digest']:
+        log.info("No change on the page for user:{}; nothing to do".format(_duo_cfg['username']))
+        _count(metrics, 'pages_unchanged')
+        return None
+
+    return _recent
+
+
+def _sync_plan(cfg=None, sessions=None, state=None):
+    """
+    The middle step of `sync_user()`: works out which tags to send for the parsed sessions.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param sessions: `XPColumns` w/ the sessions from the page
+    :param state: Optional `StateStore`. If given, only the tags that haven't already been sent for a day are sent
+    :return: `dict` w/ the `tags` to send, the `days` they are for and what to remember once they've been sent. `None`
+        if there is nothing to do
+    """
+    days = sessions.totals()
+    thresholds = _get_thresholds(cfg)
+
+    if state is None:
+        # The Exist API supports batching, thankfully.
+        return {'tags': _tags_for_days(days, thresholds=thresholds), 'days': days, 'last_seen': None, 'hours': []}
+
+    # Every visible day is checked against every tag, so that a tag added to the config later is applied to the days
+    #   that were already seen. The cursor only keeps the practice hours from counting a session twice.
+    _user = cfg['duolingo']['username']
+    _new = sessions.newer_than(state.last_seen(_user))
+    _last_seen = max(sessions.epochs[i] for i in _new) if len(_new) > 0 else None
+    _hours = [sessions.hour(i) for i in _new]
+
+    _done = {_tag: state.tagged(_user, _tag) for _, _tag in thresholds}
+    tags = [tag for tag in _tags_for_days(days, thresholds=thresholds, log_level=logging.DEBUG)
+            if tag['date'] not in _done.get(tag['value'], ())]
+    for tag in tags:
+        log.info("on {}, you managed to practice enough for {} ({} XPs)!".format(
+            tag['date'], tag['value'], days[tag['date']]))
+
+    if len(tags) < 1 and _last_seen is None:
+        log.info("No new sessions or tags for user:{}; nothing to do".format(_user))
+        return None
+
+    return {'tags': tags, 'days': days, 'last_seen': _last_seen, 'hours': _hours}
+
+
+def _sync_post(cfg=None, plan=None, state=None, metrics=None, page=None):
+    """
+    The last step of `sync_user()`: send the tags to exist.io and remember what worked.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param plan: `dict` from `_sync_plan()`
+    :param state: Optional `StateStore`, the same one that was given to `_sync_plan()`
+    :param metrics: Optional `SyncMetrics` to record timings and counters in
+    :param page: Optional `dict` from `_sync_fetch()`; remembered if every tag was accepted
+    :return: The list of tag payloads that were sent to exist.io
+    """
+    tags = plan['tags']
+    days = plan['days']
+
+    # At this point, we should have an array of objects.
+    log.debug("Applying %s tags", len(tags))
+    _result = {'success': [], 'failed': []}
+    if state is None or len(tags) > 0:
+        try:
+            with _phase(metrics, 'post'):
+                _result = do_exist_tag_update(tags, api_token=cfg['exist.io']['api_token'], metrics=metrics) or _result
+        except Exception as e:
+            raise ExistUpdateError("Unable to update exist.io. error: {}".format(e)) from e
+    _count(metrics, 'days_tagged', len(_result['success']))
+
+    # Only what exist.io accepted counts as done. If anything failed, don't move the cursor so the next run tries again
+    if state is not None:
+        _user = cfg['duolingo']['username']
+        for _tag, _tagged in _days_by_tag(_result['success'], days).items():
+            state.record(_user, _tag, days=_tagged)
+        _cursor = plan['last_seen'] if len(_result['failed']) < 1 else None
+        state.record(_user, last_seen=_cursor, hours=plan['hours'])
+
+    if len(_result['failed']) > 0:
+        _e = "Unable to update exist.io. {} of {} tags failed".format(len(_result['failed']), len(tags))
+        raise ExistUpdateError(_e)
+
+    _remember_page(cfg, state, page)
+    return tags
+
+
+def sync_user(cfg=None, state=None, metrics=None):
+    """
+    Does the actual work for a single duolingo/exist.io pair: fetch the duome page, parse out the recent sessions,
+    bucket them by day and then tag every day that meets the XP threshold.
+
+    Unlike `do_needful()`, this never calls `exit()`; errors are raised so that the caller can decide if one bad user
+    should stop everything or not.
+
+    :param cfg: `dict` in the same shape that `do_needful()` takes
+    :param state: Optional `StateStore`. If given, only days w/ new sessions that haven't already been tagged are sent
+    :param metrics: Optional `SyncMetrics` to record timings and counters in
+    :return: The list of tag payloads that were sent to exist.io
+    """
+    page = {}
+    _recent = _sync_fetch(cfg, metrics=metrics, state=state, page=page)
+    if _recent is None:
+        return []
+
+    # Pass the list items off to be processed; get back the sessions in columns
+    with _phase(metrics, 'parse_raw'):
+        sessions = parse_columns(_recent, _user_tz(cfg['duolingo']))
+    _count(metrics, 'sessions_parsed', len(sessions))
+    _record_history(cfg, sessions, metrics=metrics)
+
+    plan = _sync_plan(cfg, sessions, state=state)
+    if plan is None:
+        _remember_page(cfg, state, page)
+        return []
+    return _sync_post(cfg, plan, state=state, metrics=metrics, page=page)
+
+
+def do_needful(cfg=None, state=None):
+    """
+    The meet of the script.
+
+    :param cfg: `dict` object that should look something like this:
+    ```
+        {
+        'duolingo': {
+            'url': 'https://duome.eu/{username}',
+            'username': 'kquinsland',
+            'timezone': 'US/Pacific',
+            'min_xp': '10'
+        },
+        'exist.io': {
+            'tag': 'practice_duolingo',
+            'api_token': '<getYourOwn!>',
+        }
+    }
+    ```
+
+    :param state: Optional `StateStore`. See `sync_user()`
+    :return:
+    """
+    try:
+        sync_user(cfg, state=state)
+    except ValueError as e:
+        log.error(e)
+        exit()
+    except ExistUpdateError as e:
+        log.error(e)
+        exit(1)
+
+
+def _get_users(cfg=None):
+    """
+    Pulls the per-learner configs out of a (possibly) multi-user config document.
+
+    Learners can be listed as `[user:<name>]` sections in the INI file or under a `users` key in the SSM JSON document.
+    Either way, each learner is deep-merged over the shared `[duolingo]`/`[exist.io]` sections so only the settings
+    that differ need to be given. INI sections are flat, so each key is routed to the section it belongs in via
+    `USER_KEY_SECTIONS`. If `username` is not set, the name of the learner is used.
+
+    In the INI file:
+    ```
+        [user:alice]
+        timezone=Europe/Berlin
+        api_token=<alice's token>
+    ```
+
+    In the SSM document:
+    ```
+        "users": {
+            "alice": {"duolingo": {"timezone": "Europe/Berlin"}, "exist.io": {"api_token": "..."}}
+        }
+    ```
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :return: `dict` of learner name -> `dict` in the same shape that `do_needful()` takes. Empty if there are no
+        learners configured (read: single user mode)
+    """
+    if type(cfg) is not dict:
+        return {}
+
+    # Gather up the per-user overrides from both places they can come from
+    _overrides = {}
+    for section, values in cfg.items():
+        if section.startswith(USER_SECTION_PREFIX):
+            _overrides[section[len(USER_SECTION_PREFIX):]] = values
+    _overrides.update(cfg.get('users') or {})
+
+    users = {}
+    for name, values in _overrides.items():
+        # Start from the shared defaults...
+        _user = {
+            'duolingo': dict(cfg.get('duolingo') or {}),
+            'exist.io': dict(cfg.get('exist.io') or {})
+        }
+
+        # ... then lay the user specific bits on top.
+        for k, v in values.items():
+            if isinstance(v, collections.abc.Mapping):
+                _do_deep_merge(_user, {k: v})
+            elif k in USER_KEY_SECTIONS:
+                _user[USER_KEY_SECTIONS[k]][k] = v
+            else:
+                log.warning("Ignoring unknown setting `{}` for user:{}".format(k, name))
+
+        # Names of users loaded from a SSM path can have a path in them; the user name is the last part
+        _user['duolingo'].setdefault('username', name.rsplit('/', 1)[-1])
+        users[name] = _user
+
+    return users
+
+
+def _shard_of(name='', shard_count=1):
+    """
+    :param name: The name of a learner
+    :param shard_count: How many shards the learners are split over
+    :return: The shard, from `0` to `shard_count - 1`, that `name` belongs to. The same for every process and run;
+        unlike `hash()`, which is salted per process
+    """
+    _digest = hashlib.sha1(name.encode('utf-8')).digest()
+    return int.from_bytes(_digest[:8], 'big') % shard_count
+
+
+def _select_users(cfg=None, names=None, shard_index=None, shard_count=None):
+    """
+    Narrows a config down to some of its learners so that a big batch can be split over many lambdas/containers.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :param names: Optional `list` of learner names; only these are kept
+    :param shard_index: Optional; w/ `shard_count`, only the learners in this shard are kept. See `_shard_of()`
+    :param shard_count: Optional; how many shards the learners are split over
+    :return: `dict` w/ the same config but only the selected learners. If no learners are configured, the single user
+        is treated as a learner named after their `username`
+    :raises ValueError: if the shard is out of range
+    """
+    if shard_count is not None or shard_index is not None:
+        shard_index, shard_count = int(shard_index or 0), int(shard_count or 1)
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            _e = "Asked for shard {} of {}; the index must be at least 0 and less than the count".format(shard_index,
+                                                                                                       shard_count)
+            raise ValueError(_e)
+
+    users = _get_users(cfg)
+    if len(users) < 1:
+        users = {cfg['duolingo'].get('username', ''): cfg}
+
+    if names is not None:
+        _unknown = set(names) - users.keys()
+        if _unknown:
+            log.warning("Asked to sync users that aren't configured: {}".format(sorted(_unknown)))
+        users = {name: users[name] for name in names if name in users}
+
+    if shard_count is not None:
+        users = {name: u for name, u in users.items() if _shard_of(name, shard_count) == shard_index}
+
+    # The users are already merged w/ the shared sections; laying them over those again changes nothing
+    _cfg = {k: v for k, v in cfg.items() if k != 'users' and not k.startswith(USER_SECTION_PREFIX)}
+    _cfg['users'] = users
+    return _cfg
+
 
+def do_needful_many(cfg=None, max_workers=DEFAULT_MAX_WORKERS, state=None, metrics=None, deadline=None):
+    """
+    Runs `sync_user()` for every learner in `cfg` using a bounded pool of worker threads. Nearly all of the time spent
+    per user is waiting on duome.eu and exist.io so threads are enough to get the whole batch done in roughly the
+    time of the slowest user.
+
+    A failure for one user is logged and recorded; it does not stop the other users from being synced.
+
+    :param cfg: `dict` w/ a parsed and merged config. If no learners are configured, the single user in `cfg` is synced
+    :param max_workers: The maximum number of users to sync at the same time
+    :param state: Optional `StateStore`, shared by all users. See `sync_user()`
+    :param metrics: Optional `dict`; if given, it is filled w/ learner name -> `SyncMetrics`
+    :param deadline: Optional `time.monotonic()` by which the run must be done. A user is only started if the slowest
+        user so far would still be done in time; those that aren't started get a `DeferredError`
+    :return: `dict` of learner name -> `None` if the sync worked or the exception that was raised
+    """
+    users = _get_users(cfg)
+    if len(users) < 1 and type(cfg) is dict and 'duolingo' in cfg:
+        users = {cfg['duolingo'].get('username', ''): cfg}
+    if len(users) < 1:
+        _e = "Asked to sync users, but no users are configured. Got:`{}`".format(cfg)
+        log.error(_e)
+        return {}
+
+    log.info("Syncing {} users w/ up to {} workers...".format(len(users), max_workers))
+
+    results = {}
+    pending = collections.deque(users.items())
+    running = {}
+    _longest = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            # Users are handed to the pool only as workers free up so that the deadline can be checked for each
+            while pending and len(running) < max_workers:
+                if deadline is not None and time.monotonic() + _longest > deadline:
+                    break
+                name, _cfg = pending.popleft()
+                _m = None
+                if metrics is not None:
+                    _m = metrics[name] = SyncMetrics(user=name)
+                running[pool.submit(sync_user, _cfg, state, _m)] = name, time.monotonic()
+
+            if not running:
+                break
+
+            _done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in _done:
+                name, _started = running.pop(future)
+                _longest = max(_longest, time.monotonic() - _started)
+                try:
+                    future.result()
+                    results[name] = None
+                    log.debug("user:%s synced", name)
+                except DeferredError as e:
+                    results[name] = e
+                    log.warning("Skipped user:{}. {}".format(name, e))
+                except Exception as e:
+                    results[name] = e
+                    log.error("Unable to sync user:{}. error: {}".format(name, e))
+
+                if metrics is not None:
+                    metrics[name].ok = results[name] is None
+
+    if pending:
+        log.warning("Out of time; {} users are left for the next run".format(len(pending)))
+    for name, _ in pending:
+        results[name] = DeferredError("Out of time; not started")
+
+    _failed = [name for name, e in results.items() if e is not None]
+    log.info("Synced {} of {} users".format(len(results) - len(_failed), len(results)))
+    return results
+
+
+def _parse_recent(recent=None, tz_name=''):
+    """
+    Parses the raw XP lines of one user. Runs in the async pipeline's parse executor, which may be a process pool, so
+    only plain types go in.
 
-def _get_params_from_ssm(path='', decrypt=True, iam_profile=''):
+    :param recent: `list` of raw XP lines
+    :param tz_name: The name of the user's timezone
+    :return: `XPColumns`
     """
-    Attempts to get the document that `path` points to from Amazon Simple Systems Manager (ssm).
-    If configured, the IAM profile is also used.
-    See: https://github.com/aws/amazon-ssm-agent
+    return parse_columns(recent, timezone(tz_name))
 
-    :param path:    The full path/name to the parameter that we're to fetch
-    :param decrypt: Bool toggle; should the parameter at `path` be decrypted?
-    :param iam_profile: String. If set, will be used to configure the iam profile that the ssm client will use
 
-    :return:
+async def _sync_users_async(users=None, state=None, metrics=None, in_flight=ASYNC_MAX_IN_FLIGHT,
+                            host_limit=ASYNC_HOST_LIMIT, parse_procs=0, deadline=None):
     """
+    The async pipeline behind `do_needful_async()`. Users flow thru three stages, each w/ its own workers, connected
+    by bounded queues:
+        - fetch: `_sync_fetch()`; the cookie/tz.php/profile requests to duome.eu
+        - parse: `parse_columns()` in its own executor so it never holds up the event loop, then `_sync_plan()`
+        - post: `_sync_post()`; the exist.io update and recording what worked
+
+    The HTTP client is the blocking `requests` one, so each request waits in a thread of a pool w/ `in_flight`
+    threads; the event loop decides what runs when. A semaphore per host keeps any one site from getting more than
+    `host_limit` requests at once. When a stage falls behind, the queue in front of it fills up and the stage before
+    it waits, so no more than a few queues' worth of users are ever in memory.
+
+    :return: `dict` of learner name -> `None` if the sync worked or the exception that was raised
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    results = {}
 
-    import boto3
-    if iam_profile != '':
-        log.debug("creating boto session with iam_profile:{}".format(iam_profile))
-        # Note: You should never use AWS API keys unless you have to. And if you must use API keys, then you should
-        #   NEVER hard code them. This tool will not allow you to use API keys, so there's no risk of hard-coding ;)
-        #   Should you want to create a hard-fork, though, this is where you'd want to hard-code in your AWS API keys.
-        session = boto3.Session(profile_name=iam_profile)
+    _io = concurrent.futures.ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix='io')
+    if parse_procs > 0:
+        _parse = concurrent.futures.ProcessPoolExecutor(max_workers=parse_procs)
     else:
-        session = boto3.Session()
-
-    # Get a SSM client using the session
-    client = session.client('ssm')
+        _parse = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='parse')
+
+    _hosts = {}
+
+    def _host(url=''):
+        _name = urllib.parse.urlsplit(url).hostname
+        if _name not in _hosts:
+            _hosts[_name] = asyncio.Semaphore(host_limit)
+        return _hosts[_name]
+
+    # When each user in flight was started and the longest that any user has taken so far
+    _started = {}
+    _longest = [0]
+
+    def _done(name, e=None):
+        results[name] = e
+        if name in _started:
+            _longest[0] = max(_longest[0], time.monotonic() - _started.pop(name))
+        if isinstance(e, DeferredError):
+            log.warning("Skipped user:{}. {}".format(name, e))
+        elif e is not None:
+            log.error("Unable to sync user:{}. error: {}".format(name, e))
+        if metrics is not None:
+            metrics[name].ok = e is None
+
+    _fetch_q = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    _parse_q = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    _post_q = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+
+    async def _fetcher():
+        while True:
+            name, cfg, m = await _fetch_q.get()
+            try:
+                if deadline is not None and time.monotonic() + _longest[0] > deadline:
+                    raise DeferredError("Out of time; not started")
+                _started[name] = time.monotonic()
+                _page = {}
+                async with _host(cfg['duolingo']['url']):
+                    _recent = await loop.run_in_executor(_io, _sync_fetch, cfg, m, state, _page)
+                if _recent is None:
+                    _done(name)
+                else:
+                    await _parse_q.put((name, cfg, m, _recent, _page))
+            except Exception as e:
+                _done(name, e)
+            finally:
+                _fetch_q.task_done()
+
+    async def _parser():
+        while True:
+            name, cfg, m, _recent, _page = await _parse_q.get()
+            try:
+                with _phase(m, 'parse_raw'):
+                    sessions = await loop.run_in_executor(_parse, _parse_recent, _recent, cfg['duolingo']['timezone'])
+                _count(m, 'sessions_parsed', len(sessions))
+
+                # Reads the state store/history log, which may have to wait on their locks; keep that off the loop too
+                await loop.run_in_executor(_io, _record_history, cfg, sessions, m)
+                plan = await loop.run_in_executor(_io, _sync_plan, cfg, sessions, state)
+                if plan is None:
+                    await loop.run_in_executor(_io, _remember_page, cfg, state, _page)
+                    _done(name)
+                else:
+                    await _post_q.put((name, cfg, m, plan, _page))
+            except Exception as e:
+                _done(name, e)
+            finally:
+                _parse_q.task_done()
+
+    async def _poster():
+        while True:
+            name, cfg, m, plan, _page = await _post_q.get()
+            try:
+                async with _host(EXIST_APPEND_URL):
+                    await loop.run_in_executor(_io, _sync_post, cfg, plan, state, m, _page)
+                _done(name)
+            except Exception as e:
+                _done(name, e)
+            finally:
+                _post_q.task_done()
+
+    _workers = [loop.create_task(_fetcher()) for _ in range(in_flight)]
+    _workers += [loop.create_task(_parser()) for _ in range(max(parse_procs, 1) * 2)]
+    _workers += [loop.create_task(_poster()) for _ in range(host_limit)]
 
     try:
-        log.debug("Fetching Parameters from ssm:{} ...".format(path))
-        ssm_param_response = client.get_parameter(Name=path, WithDecryption=decrypt)
+        for name, cfg in users.items():
+            _m = None
+            if metrics is not None:
+                _m = metrics[name] = SyncMetrics(user=name)
+            await _fetch_q.put((name, cfg, _m))
+
+        # Everything that leaves a stage has been put on the next queue by the time it is marked done
+        for _q in (_fetch_q, _parse_q, _post_q):
+            await _q.join()
+    finally:
+        for _w in _workers:
+            _w.cancel()
+        await asyncio.gather(*_workers, return_exceptions=True)
+        _io.shutdown(wait=True)
+        _parse.shutdown(wait=True)
+
+    return results
+
+
+def do_needful_async(cfg=None, in_flight=ASYNC_MAX_IN_FLIGHT, host_limit=ASYNC_HOST_LIMIT, parse_procs=0,
+                     state=None, metrics=None, deadline=None):
+    """
+    Same as `do_needful_many()`, but the users go thru the async pipeline in `_sync_users_async()`. Rather than a
+    thread per user, each stage of the sync keeps as many requests going as it is allowed to, so a single small
+    container can have hundreds of requests in flight.
+
+    :param cfg: `dict` w/ a parsed and merged config. If no learners are configured, the single user in `cfg` is synced
+    :param in_flight: The most requests waiting on a response at once
+    :param host_limit: The most requests to any one host at once; capped at `HTTP_POOL_SIZE`
+    :param parse_procs: If more than 0, parse in a pool of this many processes instead of a thread
+    :param state: Optional `StateStore`, shared by all users. See `sync_user()`
+    :param metrics: Optional `dict`; if given, it is filled w/ learner name -> `SyncMetrics`
+    :param deadline: Optional `time.monotonic()` by which the run must be done. See `do_needful_many()`
+    :return: `dict` of learner name -> `None` if the sync worked or the exception that was raised
+    """
+    users = _get_users(cfg)
+    if len(users) < 1 and type(cfg) is dict and 'duolingo' in cfg:
+        users = {cfg['duolingo'].get('username', ''): cfg}
 
-        log.debug("got ssm data, last updated:{}".format(ssm_param_response['Parameter']['LastModifiedDate']))
+    if host_limit > HTTP_POOL_SIZE:
+        log.warning("A host limit of {} is more than the {} connections kept per host; using {}".format(
+            host_limit, HTTP_POOL_SIZE, HTTP_POOL_SIZE))
+        host_limit = HTTP_POOL_SIZE
 
-        # Return False to indicate that there was an error pulling the params that we expected
-        return json.loads(ssm_param_response['Parameter']['Value']) or False
+    log.info("Syncing {} users w/ up to {} requests in flight ({} per host)...".format(len(users), in_flight,
+                                                                                      host_limit))
+    import asyncio
+    results = asyncio.run(_sync_users_async(users, state=state, metrics=metrics, in_flight=in_flight,
+                                            host_limit=host_limit, parse_procs=parse_procs, deadline=deadline))
 
-    except Exception as e:
-        _e = "Something broke while trying to pull values from SSM. e:{}".format(e)
-        log.error(_e)
-        raise e
+    _failed = [name for name, e in results.items() if e is not None]
+    log.info("Synced {} of {} users".format(len(results) - len(_failed), len(results)))
+    return results
 
 
-def _parse_cfg(cfg_file=''):
+def _run(cfg, max_workers=DEFAULT_MAX_WORKERS, metrics=None, pipeline=None, deadline=None, results=None):
     """
-    Validates file and returns an object representing the parsed content of the file
-    :param cfg_file: The path to the cfg file we're to validate and parse
-    :return: A `dict` representing the parsed config file
+    Syncs every configured user (or the one user in `cfg`) w/ a thread per user or, if asked for, the async pipeline.
+    If a state store is configured, it is opened for the run and closed (and, if needed, uploaded) afterwards.
+
+    Nothing here calls `exit()`, so a warm lambda container survives the run.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :param max_workers: The maximum number of users to sync at the same time
+    :param metrics: Optional `dict`; if given, it is filled w/ user name -> `SyncMetrics`
+    :param pipeline: Optional `dict` of settings for `do_needful_async()`. If given, users are synced w/ the async
+        pipeline instead of a thread per user
+    :param deadline: Optional `time.monotonic()` after which no more users are started. See `do_needful_many()`
+    :param results: Optional `dict`; if given, it is filled w/ user name -> `None` or the exception that was raised
+    :return: `True` if every user was synced
     """
-    if not os.path.isfile(cfg_file):
-        _e = "The config file {} can't be accessed. Does it exist and have correct permissions?".format(cfg_file)
-        log.fatal(_e)
-        raise Exception(_e)
+    if results is None:
+        results = {}
 
-    log.debug("Parsing config from {}...".format(cfg_file))
-
-    # Stand up config parser and point it @ the file...
-    cfg = configparser.ConfigParser()
-    cfg.read(cfg_file)
+    state = _open_state(cfg)
+    try:
+        if pipeline is not None:
+            results.update(do_needful_async(cfg, state=state, metrics=metrics, deadline=deadline, **pipeline))
+            return len(results) > 0 and all(e is None for e in results.values())
 
-    # Turn the entire parsed document into a dict and return to the caller
-    # Thanks to this uber elegant solution: https://stackoverflow.com/a/28990982/1521764
-    cfg = {s: dict(cfg.items(s)) for s in cfg.sections()}
-    return cfg
+        # A single user goes thru the same per-user error handling and deadline as a batch of them
+        results.update(do_needful_many(cfg, max_workers=max_workers, state=state, metrics=metrics, deadline=deadline))
+        return len(results) > 0 and all(e is None for e in results.values())
+    finally:
+        if state is not None:
+            state.close()
 
 
-def fetch_page(url='', gmt_delta=''):
+def _next_poll_delay(hours=None, now_hour=0):
     """
-    Takes a URL and a Timezone. Gets a session cookie, associates a timezone w/ the session
-    and then uses the session to request user data
+    Works out how long to wait before polling a user again. Users tend to practice at about the same time each day;
+    the more of a user's past sessions fall in the hours around `now_hour`, the sooner the next poll. Users w/o
+    enough history are polled every `DAEMON_DEFAULT_INTERVAL`.
 
-    :param url: The URL of the page to fetch.
-    :param gmt_delta:
-    :return:
+    :param hours: `list` of 24 session counts. See `StateStore.practice_hours()`
+    :param now_hour: The current hour of the day, local to the user
+    :return: Seconds until the next poll, jittered by +/- `DAEMON_JITTER` so that users don't all line up
     """
+    hours = hours or [0] * 24
+    _total = sum(hours)
 
-    log.debug("Fetching url:{} gmt_delta:{}".format(url, gmt_delta))
-
-    # We pretend to be a chrome browser...
-    initial_headers = {
-        'authority': 'duome.eu',
-        'pragma': 'no-cache',
-        'cache-control': 'no-cache',
-        'upgrade-insecure-requests': '1',
-        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_2) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/78.0.3904.108 Safari/537.36',
+    if _total < DAEMON_MIN_HISTORY:
+        _delay = DAEMON_DEFAULT_INTERVAL
+    else:
+        # Share of sessions in the hour before/of/after now vs. what that share would be if practice was spread out
+        _window = sum(hours[(now_hour + i) % 24] for i in (-1, 0, 1)) / _total
+        _ratio = min(_window / (2 * 3 / 24), 1.0)
+        _delay = DAEMON_MAX_INTERVAL - (DAEMON_MAX_INTERVAL - DAEMON_MIN_INTERVAL) * _ratio
 
-        'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,'
-                  'application/signed-exchange;v=b3',
-        'sec-fetch-site': 'same-origin',
-        'sec-fetch-mode': 'navigate',
-        'accept-encoding': 'gzip, deflate, br',
-        'accept-language': 'en-US,en;q=0.9',
-    }
+    return _delay * random.uniform(1 - DAEMON_JITTER, 1 + DAEMON_JITTER)
 
-    # The magic cookie needed before we can get working results
-    magic_cookie = "PHPSESSID"
-
-    # The URL parameters we'll pass along when getting a timezone
-    tz_params = (
-        # We will get a timedelta like -0800 to indicate that we  are -08 hours and 00 min behind GMT
-        #   but the duome API will see -0800 as LITERALLY 800 hours behind GMT. Not ideal!
-        # So, we str -> int to drop the leading 0, then turn the int back into a string
-        #   and then split (at most 1  time) on the 0. Since the only 0's we have are trailing
-        #   the split will give us two tokens: the significant bits and the trailing 0's.
-        # Just toss the latter token and we have what we need:
-        #   -0800 -> -800 -> -8, 00 -> -8
-        ##
-        ('time', "GMT {}".format(str(int(gmt_delta)).split("0", 1)[0])),
-    )
 
-    # Requests w/o a valid PHPSESSID/magic_cookie cookie are denied; we use Session() to manage cookies
-    # The cookie manages the time zone...
-    s = requests.session()
+def run_daemon(cfg=None, max_workers=DEFAULT_MAX_WORKERS, stop=None, watcher=None):
+    """
+    Keeps polling every configured user until stopped. Each user has their own schedule (see `_next_poll_delay()`)
+    so polls bunch up around the times that the user usually practices and thin out the rest of the day. The first
+    poll of each user is spread over `DAEMON_MIN_INTERVAL` so that a restart doesn't hit duome.eu w/ every user at
+    once.
+
+    The state store from the config is used to skip sessions that have already been handled; if there isn't one, an
+    in-memory one is used for the life of the daemon.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :param max_workers: The maximum number of users to sync at the same time
+    :param stop: `threading.Event`; the daemon returns once it is set. If not set, SIGTERM/SIGINT stop the daemon.
+    :param watcher: Optional `_ConfigWatcher`. If given, config changes are picked up w/o a restart: new users are
+        scheduled, removed users are dropped once their running sync (if any) is done and everyone else uses their new
+        settings from their next poll on. The state store stays the one that the daemon was started w/.
+    :return:
+    """
+    if stop is None:
+        stop = threading.Event()
+        for _sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(_sig, lambda *_: stop.set())
 
-    # First, ask for *a* session cookie...
-    fake = s.get(url, headers=initial_headers)
+    users = _get_users(cfg) or {cfg['duolingo']['username']: cfg}
+    state = _open_state(cfg) or StateStore(':memory:')
 
-    # Now that we have a session cookie, set the timezone associated w/ our session...
-    tz_resp = s.get('https://duome.eu/tz.php', params=tz_params)
-    tz_resp.raise_for_status()
+    _now = time.time()
+    schedule = [(_now + random.uniform(0, DAEMON_MIN_INTERVAL), name) for name in users]
+    heapq.heapify(schedule)
 
-    # Now, theoretically, we have a session cookie that has been associated w/ a timezone
-    response = s.get(url, headers=initial_headers)
+    log.info("Daemon polling {} users w/ up to {} workers...".format(len(users), max_workers))
 
-    # If we don't get a 200, make noise
-    response.raise_for_status()
+    running = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while not stop.is_set():
+                _cfg = watcher.poll() if watcher is not None else None
+                if _cfg is not None:
+                    _users = _get_users(_cfg) or {_cfg['duolingo']['username']: _cfg}
+                    _scheduled = {name for _, name in schedule} | set(running.values())
+                    for name in _users.keys() - _scheduled:
+                        heapq.heappush(schedule, (time.time() + random.uniform(0, DAEMON_MIN_INTERVAL), name))
+                    log.info("Now polling {} users ({} new, {} dropped)".format(
+                        len(_users), len(_users.keys() - users.keys()), len(users.keys() - _users.keys())))
+                    users = _users
+
+                # Start everyone that is due. Users that were dropped from the config are not put back on the schedule
+                _now = time.time()
+                while schedule and schedule[0][0] <= _now:
+                    _, name = heapq.heappop(schedule)
+                    if name in users:
+                        running[pool.submit(sync_user, users[name], state)] = name
+
+                # Wait for a sync to finish or for the next user to be due, whichever is first
+                _timeout = max(schedule[0][0] - _now, 0) if schedule else DAEMON_DEFAULT_INTERVAL
+                if watcher is not None:
+                    _timeout = min(_timeout, CFG_RELOAD_INTERVAL)
+                if running:
+                    _done, _ = concurrent.futures.wait(running, timeout=_timeout,
+                                                       return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    stop.wait(_timeout)
+                    _done = []
+
+                for future in _done:
+                    name = running.pop(future)
+                    if name not in users:
+                        continue
+                    _duo_cfg = users[name]['duolingo']
+                    try:
+                        future.result()
+                        _delay = _next_poll_delay(state.practice_hours(_duo_cfg['username']),
+                                                  datetime.datetime.now(_user_tz(_duo_cfg)).hour)
+                    except HostUnavailableError as e:
+                        # Try again soon after the breaker lets a probe thru, not a whole interval later
+                        log.warning("Deferred user:{}. {}".format(name, e))
+                        _delay = BREAKER_COOLDOWN * random.uniform(1, 1 + DAEMON_JITTER)
+                    except Exception as e:
+                        log.error("Unable to sync user:{}. error: {}".format(name, e))
+                        _delay = DAEMON_DEFAULT_INTERVAL * random.uniform(1 - DAEMON_JITTER, 1 + DAEMON_JITTER)
+
+                    log.debug("Next poll of user:%s in %.0fs", name, _delay)
+                    heapq.heappush(schedule, (time.time() + _delay, name))
+    finally:
+        state.close()
+
+    log.info("Daemon stopped")
+
+
+class _SingleFlight(object):
+    """
+    Makes sure that only one call per key runs at a time. Everyone that asks for a key while it is running waits for
+    and gets the same outcome. That outcome is then handed out for `ttl` seconds before the key is run again.
+    """
 
-    # Parse HTML and save to BeautifulSoup object¶
-    return BeautifulSoup(response.text, "html.parser")
+    def __init__(self, ttl=SERVE_RESULT_TTL):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._running = {}
+        self._done = {}
+
+    def do(self, key='', fn=None, *args):
+        """
+        :param key: What the call is for; calls w/ the same key are coalesced
+        :param fn: Called w/ `args` if there's no outcome for `key` that can be handed out
+        :param args: Passed to `fn`
+        :return: tuple of ((what `fn` returned, the exception it raised), how the outcome was got: `ran`, `shared` w/
+            a call that was already running or `cached`)
+        """
+        with self._lock:
+            _cached = self._done.get(key)
+            if _cached is not None and _cached[0] > time.monotonic():
+                return _cached[1], 'cached'
+
+            future = self._running.get(key)
+            if future is not None:
+                _how = 'shared'
+            else:
+                future = self._running[key] = concurrent.futures.Future()
+                _how = 'ran'
+
+        if _how == 'shared':
+            return future.result(), _how
+
+        # Whatever happens, the key is freed and the waiters are woken; anything that isn't an `Exception` (E.G.:
+        #   `SystemExit`) is raised in every waiter too and not kept for later
+        outcome = None
+        try:
+            outcome = fn(*args), None
+        except Exception as e:
+            outcome = None, e
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if outcome is not None:
+                    self._done[key] = (time.monotonic() + self._ttl, outcome)
+                del self._running[key]
+
+        future.set_result(outcome)
+        return outcome, _how
+
+
+def _parse_address(address=''):
+    """
+    :param address: `[HOST:]PORT` or `HOST`
+    :return: tuple of (host, port). The host defaults to `127.0.0.1` and the port to `SERVE_DEFAULT_PORT`
+    :raises ValueError: if the port isn't a number
+    """
+    _host, _, _port = address.rpartition(':')
+    if _host == '' and not _port.isdigit():
+        _host, _port = _port, ''
+    return _host or '127.0.0.1', int(_port or SERVE_DEFAULT_PORT)
 
 
-def parse_raw(recent, user_tz):
+def run_server(cfg=None, address=('127.0.0.1', SERVE_DEFAULT_PORT), watcher=None, token=''):
     """
-    Takes the beautiful-soup objects and the user's TZ and returns localized time + exp tuples
+    Serves on-demand syncs over HTTP until SIGTERM/SIGINT: `POST /sync/<user>` syncs that user right away, E.G. from a
+    shortcut on a phone after a lesson.
 
-    :param recent:
-    :param user_tz:
+    Syncs of the same user are coalesced; while one is running, everyone else that asks for that user waits for it
+    and gets its outcome. That outcome is handed out for `SERVE_RESULT_TTL` seconds after, so a burst of requests
+    costs one poll of duome.eu and at most one update of exist.io.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :param address: tuple of (host, port) to listen on
+    :param watcher: Optional `_ConfigWatcher`; if given, config changes are picked up w/o a restart
+    :param token: If set, requests need an `Authorization: Bearer <token>` header
     :return:
     """
+    # Only needed here; they're not worth importing on every other run
+    import http.server
+    import hmac
+
+    class _SyncHandler(http.server.BaseHTTPRequestHandler):
+        """
+        `POST /sync/<user>` syncs a user now and answers w/ the outcome as JSON. `GET /health` is for load balancers.
+        """
+
+        def log_message(self, fmt, *args):
+            log.debug("%s %s", self.address_string(), fmt % args)
+
+        def _send(self, status=200, body=None):
+            _body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(_body)))
+            self.end_headers()
+            self.wfile.write(_body)
+
+        def do_GET(self):
+            if urllib.parse.urlsplit(self.path).path == '/health':
+                return self._send(body={'ok': True})
+            return self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            # Anything that is refused is refused before the body is read; the connection is closed, not drained
+            self.close_connection = True
+
+            server = self.server
+            if server.token and not hmac.compare_digest(self.headers.get('Authorization', ''),
+                                                        'Bearer {}'.format(server.token)):
+                return self._send(401, {'error': 'unauthorized'})
+
+            try:
+                _length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                _length = -1
+            if _length < 0:
+                return self._send(400, {'error': 'bad Content-Length'})
+            if _length > SERVE_MAX_BODY:
+                return self._send(413, {'error': 'body too large'})
+
+            # Nothing is read from the body, but it has to be drained
+            self.rfile.read(_length)
+            self.close_connection = False
+
+            _path = urllib.parse.urlsplit(self.path).path
+            if not _path.startswith('/sync/'):
+                return self._send(404, {'error': 'not found'})
+
+            name = urllib.parse.unquote(_path[len('/sync/'):])
+            cfg = server.user_cfg(name)
+            if cfg is None:
+                return self._send(404, {'user': name, 'error': 'unknown user'})
+
+            (tags, e), _how = server.flight.do(name, sync_user, cfg, server.state)
+            log.info("Sync of user:{} asked for; {} ({})".format(name, 'ok' if e is None else e, _how))
+
+            _status = 200
+            if isinstance(e, DeferredError):
+                _status = 503
+            elif e is not None:
+                _status = 502
+            return self._send(_status, {'user': name, 'ok': e is None, 'error': None if e is None else str(e),
+                                        'tags': tags or [], 'result': _how})
+
+
+    class _SyncServer(http.server.ThreadingHTTPServer):
+        daemon_threads = True
+
+        def __init__(self, address=None, cfg=None, state=None, watcher=None, token=''):
+            super().__init__(address, _SyncHandler)
+            self.state = state
+            self.token = token
+            self.flight = _SingleFlight()
+            self._watcher = watcher
+            self._lock = threading.Lock()
+            self._users = _get_users(cfg) or {cfg['duolingo']['username']: cfg}
+
+        def user_cfg(self, name=''):
+            """
+            :param name: The name of a learner
+            :return: The config for `name` or `None` if they aren't configured. Config changes are picked up first
+            """
+            with self._lock:
+                _cfg = self._watcher.poll() if self._watcher is not None else None
+                if _cfg is not None:
+                    self._users = _get_users(_cfg) or {_cfg['duolingo']['username']: _cfg}
+                return self._users.get(name)
+
+    state = _open_state(cfg) or StateStore(':memory:')
+    server = _SyncServer(address, cfg=cfg, state=state, watcher=watcher, token=token)
+
+    # `shutdown()` waits for `serve_forever()` to return, so it can't be called from the thread that is serving
+    for _sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(_sig, lambda *_: threading.Thread(target=server.shutdown).start())
+
+    log.info("Serving syncs on http://{}:{}/sync/<user>".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        state.close()
 
-    #  Dict to store the date => XP map we'll return to the caller
-    sessions = {}
-
-    # process each raw element
-    for session in recent:
-        # Pull the text out of the HTML element
-        # It will look like this:
-        #   2019-12-12 16:11:48 · 13XP
-        #
-        # So just split on the `·` character, trim and done!
-        _raw_line = session.text
-
-        # Skip empty lines
-        if _raw_line == "":
-            continue
+    log.info("Server stopped")
 
-        _tokens = _raw_line.split("·")
 
-        # Check that we have the correct number of tokens, otherwise  emit a warning and try parsing the next one...
-        if len(_tokens) != 2:
-            _e = "unable to parse [{raw}]. Needed exactly 2 _tokens, but got {len}. _tokens:{tok}".format(
-                raw=_raw_line,
-                len=len(_tokens),
-                tok=_tokens
-            )
-            log.warning(_e)
-            continue
+def _iter_backfill_lines(path='', default_user=''):
+    """
+    Reads a history file one record at a time and turns every record into the same `2019-12-12 16:11:48 · 13XP` line
+    that duome.eu shows. That way the backfill goes thru exactly the same parsing rules as a regular sync.
 
-        # Otherwise, assume valid split and move on to turning the _when  into a real date
-        # Note: it appears that the _when will be the time that the lesson was finished local to the user
-        #   and *not* necessarily local to the host that runs this script. This means that the script should be
-        #   run in the same time zone as the user, otherwise the definition of "day"
-        #   matter, here :)
-        ##
-        _when = _tokens[0].strip()
-        # _when will be in format `2019-12-12 16:11:48` local to  user
-        _when = datetime.datetime.strptime(_when, '%Y-%m-%d %H:%M:%S')
-        _when = user_tz.localize(_when)
+    Supported formats (by file extension):
+        - `.csv`: a header row w/ `when` and `xp` columns and, optionally, a `user` column
+        - `.jsonl`: one `{"when": "2019-12-12 16:11:48", "xp": 13, "user": "optional"}` object per line
+        - `.html`/`.htm`: a saved duome.eu profile page
+        - anything else: the raw lines as they appear on duome.eu
 
-        # In some cases, the secnod token will be in the format of '14XP stories / timed practice' so we must
-        #   split *again* on 'XP'
-        ##
-        _xp = _tokens[1].split('XP')[0].strip()
-        _xp = int(_xp)
+    Timestamps must be local to the user, just like on duome.eu. Records that can't be read at all (E.G.: broken
+    JSON) are logged and skipped; whether the line that a record makes can be parsed is up to `_backfill_chunk()`.
 
-        log.debug("earned {xp} on {dt}".format(xp=_xp, dt=_when))
-        sessions[_when] = _xp
+    :param path: The file to read
+    :param default_user: The user that records w/o a `user` belong to
+    :return: generator of (user, line, is_snapshot, line number in the file; 0 for saved pages) tuples
+    """
+    _ext = os.path.splitext(path)[1].lower()
+
+    if _ext in ('.html', '.htm'):
+        with open(path, 'rb') as f:
+            _recent = _recent_from_chunks(iter(lambda: f.read(STREAM_CHUNK_SIZE), b''),
+                                          max_bytes=os.path.getsize(path), source=path)
+        for line in _recent or []:
+            yield default_user, line, True, 0
+        return
+
+    with open(path, 'r', newline='') as f:
+        if _ext == '.csv':
+            _reader = csv.DictReader(f)
+            if not {'when', 'xp'}.issubset(_reader.fieldnames or ()):
+                log.error("Skipping {}; it needs `when` and `xp` columns. Got:{}".format(path, _reader.fieldnames))
+                return
+            for row in _reader:
+                yield row.get('user') or default_user, "{} · {}XP".format(row['when'], row['xp']), False, \
+                    _reader.line_num
+
+        elif _ext == '.jsonl':
+            for n, line in enumerate(f, 1):
+                if line.strip() == '':
+                    continue
+                try:
+                    _r = json.loads(line)
+                    yield _r.get('user') or default_user, "{} · {}XP".format(_r['when'], _r['xp']), False, n
+                except (ValueError, KeyError, AttributeError) as e:
+                    log.warning("Skipping {}:{}; not a valid record. error: {!r}".format(path, n, e))
 
-    return sessions
+        else:
+            for n, line in enumerate(f, 1):
+                yield default_user, line.strip(), False, n
 
 
-def do_needful(cfg=None):
+def _backfill_chunk(lines=None, tz_name='', path='', line_numbers=None):
     """
-    The meet of the script.
-
-    :param cfg: `dict` object that should look something like this:
-    ```
-        {
-        'duolingo': {
-            'url': 'https://duome.eu/{username}',
-            'username': 'kquinsland',
-            'timezone': 'US/Pacific',
-            'min_xp': '10'
-        },
-        'exist.io': {
-            'tag': 'practice_duolingo',
-            'api_token': '<getYourOwn!>',
-        }
-    }
-    ```
-
-    :return:
+    Parses a chunk of history lines and buckets them by day. Runs in a worker process so only plain types go in/out.
+    Lines that can't be parsed are left out; the rest of the chunk still counts.
+
+    :param lines: `list` of raw XP lines
+    :param tz_name: The name of the user's timezone
+    :param path: The file the lines came from
+    :param line_numbers: Optional `array` w/ the line number in `path` of each line
+    :return: tuple of (`dict` of `YYYY-MM-DD` -> XP earned on that day, `list` of (`file:line`, error) for every line
+        that was left out)
     """
+    _tz = timezone(tz_name)
+    try:
+        return parse_columns(lines, _tz).totals(), []
+    except ValueError:
+        pass
+
+    # Something in the chunk is bad; go again, a line at a time, to find out what
+    columns = XPColumns()
+    bad = []
+    for i, line in enumerate(lines):
+        try:
+            parse_columns((line,), _tz, columns)
+        except ValueError as e:
+            _n = line_numbers[i] if line_numbers else 0
+            bad.append(("{}:{}".format(path, _n) if _n else path, str(e)))
+    return columns.totals(), bad
+
+
+def do_backfill(cfg=None, paths=None, default_user='', max_procs=None, state=None):
+    """
+    Imports a (potentially huge) practice history and tags every qualifying day on exist.io. This is how a new user
+    gets the days that are older than the 7 that duome.eu shows.
+
+    The history files are streamed; lines are grouped into chunks of `BACKFILL_CHUNK_SIZE` which are parsed and
+    bucketed by day in a pool of worker processes. Only the per-day totals are kept, so memory use depends on the
+    number of days in the history, not the number of sessions. At most two chunks per worker are in flight at once.
+
+    Saved duome.eu pages overlap each other (each has the last 7 days) so sessions from them are de-duplicated.
+    Records from CSV/JSONL exports are assumed to be unique.
+
+    Lines that can't be parsed are skipped and logged as `file:line`. A file that can't be read is skipped. If a
+    chunk can't be processed at all, only the user it belongs to fails; everyone else is still tagged.
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :param paths: `list` of history files. See `_iter_backfill_lines()` for formats
+    :param default_user: The user that records w/o a `user` belong to. Defaults to the only configured user
+    :param max_procs: The number of worker processes to parse with. Defaults to the number of CPUs
+    :param state: Optional `StateStore`. If given, days that were already tagged are skipped and newly tagged days are
+        recorded
+    :return: `dict` of user -> `None` if the backfill worked or the exception that was raised
+    """
+    users = _get_users(cfg) or {cfg['duolingo']['username']: cfg}
+    if default_user == '' and len(users) == 1:
+        default_user = next(iter(users))
+
+    log.info("Backfilling {} files for {} users...".format(len(paths or []), len(users)))
+
+    # user -> day -> XP. This is all that's kept in memory
+    days = {name: {} for name in users}
+
+    # user -> (lines, their line numbers) waiting to be sent to a worker. Chunks never span files
+    pending = {}
+
+    # user -> the exception that stopped one of their chunks from being processed
+    failed = {}
+
+    # user -> number of lines that couldn't be parsed
+    bad_lines = {}
+
+    # Saved pages overlap, keep track of what we've seen from them
+    seen = set()
+    unknown = set()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_procs) as pool:
+        _in_flight = {}
+        _max_in_flight = 2 * (max_procs or os.cpu_count() or 1)
+
+        def _merge(done):
+            for future in done:
+                name, path = _in_flight.pop(future)
+                try:
+                    _days, _bad = future.result()
+                except Exception as e:
+                    _e = "Unable to backfill part of {} for user:{}. error: {}".format(path, name, e)
+                    log.error(_e)
+                    failed.setdefault(name, e)
+                    continue
+
+                _add_days(days[name], _days)
+                for _where, _why in _bad:
+                    bad_lines[name] = bad_lines.get(name, 0) + 1
+                    if bad_lines[name] <= BACKFILL_BAD_LINES_LOGGED:
+                        log.warning("Skipping {} for user:{}. error: {}".format(_where, name, _why))
+
+        def _submit(name, path):
+            # Don't let the readers get too far ahead of the workers
+            while len(_in_flight) >= _max_in_flight:
+                _done, _ = concurrent.futures.wait(_in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                _merge(_done)
+
+            _tz = users[name]['duolingo']['timezone']
+            _lines, _numbers = pending.pop(name)
+            _in_flight[pool.submit(_backfill_chunk, _lines, _tz, path, _numbers)] = (name, path)
+
+        for path in paths or []:
+            log.debug("Reading history from %s", path)
+            try:
+                for name, line, is_snapshot, n in _iter_backfill_lines(path, default_user=default_user):
+                    if name not in users:
+                        if name not in unknown:
+                            log.warning("Skipping history for unknown user:{}".format(name))
+                            unknown.add(name)
+                        continue
+
+                    if is_snapshot:
+                        if (name, line) in seen:
+                            continue
+                        seen.add((name, line))
+
+                    _lines, _numbers = pending.setdefault(name, ([], array.array('L')))
+                    _lines.append(line)
+                    _numbers.append(n)
+                    if len(_lines) >= BACKFILL_CHUNK_SIZE:
+                        _submit(name, path)
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                log.error("Unable to read {}; the rest of it is skipped. error: {}".format(path, e))
+
+            for name in list(pending):
+                _submit(name, path)
+
+        _merge(list(_in_flight))
+
+    for name, n in bad_lines.items():
+        log.warning("Skipped {} lines that could not be parsed for user:{}".format(n, name))
+
+    # A user w/ a chunk missing would be tagged from a partial history; they're left for another go
+    results = _tag_history(users, {name: _days for name, _days in days.items() if name not in failed}, state=state)
+    for name, e in failed.items():
+        results[name] = e
+    return results
+
+
+def _tag_history(users=None, days=None, state=None):
+    """
+    Tags every day in a user's history that meets one of their thresholds and hasn't been tagged yet. Shared by
+    `do_backfill()` and `do_retag()`.
+
+    :param users: `dict` of user name -> config. See `_get_users()`
+    :param days: `dict` of user name -> `dict` of `YYYY-MM-DD` -> XP
+    :param state: Optional `StateStore`. If given, days that were already tagged are skipped and newly tagged days are
+        recorded
+    :return: `dict` of user -> `None` if the tagging worked or the exception that was raised
+    """
+    results = {}
+    for name, _days in days.items():
+        if len(_days) < 1:
+            continue
 
-    # First, make sure that we have a valid CFG.
-    if cfg is None:
-        cfg = dict()
-    if type(cfg) is not dict or 'exist.io' not in cfg:
-        _e = "was given an invalid config file. Got:`{}`".format(cfg)
-        log.error(_e)
-        exit()
-    ##
-    # Otherwise, cfg should look like this:
-
-    ##
-    _duo_cfg = cfg['duolingo']
-    _exist_cfg = cfg['exist.io']
+        _cfg = users[name]
+        _user = _cfg['duolingo']['username']
+        thresholds = _get_thresholds(_cfg)
+        _done = {}
+        if state is not None:
+            _done = {_tag: state.tagged(_user, _tag) for _, _tag in thresholds}
 
-    # Localize now() to user time zone, then figure out how far it is from GMT.
-    _now = datetime.datetime.now()
-    _user_tz = timezone(_duo_cfg['timezone'])
-    _now = _user_tz.localize(_now)
-    _offset = _now.strftime('%z')
+        tags = [tag for tag in _tags_for_days(_days, thresholds=thresholds, log_level=logging.DEBUG)
+                if tag['date'] not in _done.get(tag['value'], ())]
+        log.info("user:{} earned {} new tags over {} days".format(name, len(tags), len(_days)))
 
-    log.debug("_now:{}".format(_now))
-    log.debug("_offset:{}".format(_offset))
+        if len(tags) < 1:
+            results[name] = None
+            continue
 
-    # Build a url from the user name
-    _url = _duo_cfg['url'].format(username=_duo_cfg['username'])
+        # The client sends the tags in batches; a failed batch doesn't stop the rest
+        _result = do_exist_tag_update(tags, api_token=_cfg['exist.io']['api_token'])
+        if state is not None:
+            for _tag, _tagged in _days_by_tag(_result['success'], _days).items():
+                state.record(_user, _tag, days=_tagged)
 
-    # Pass the URL to fetcher; include time zone so service knows how to localize data for us... (REQUIRED!)
-    soup = fetch_page(url=_url, gmt_delta=_offset)
+        results[name] = None
+        if len(_result['failed']) > 0:
+            _e = "Unable to update exist.io for user:{}. {} of {} tags failed".format(
+                name, len(_result['failed']), len(tags))
+            log.error(_e)
+            results[name] = ExistUpdateError(_e)
 
-    # The raw data that we care about is located in
-    #   <div class="hidden" id="raw">
-    # This will be a series of 5 <li> elements, each with the most recent date + the XP level
-    raw = soup.find('div', {'class': 'hidden', 'id': 'raw'})
+    return results
 
-    # From the RAW object, pull the list items
-    _recent = raw.find_all('li')
 
-    # Pass the list items off to be processed; get back localized date/time + EXP tuples
-    sessions = parse_raw(_recent, _user_tz)
+def do_retag(cfg=None, state=None):
+    """
+    Tags every day in each user's XP history log (see `XPLog`) that meets their thresholds and hasn't been tagged yet.
+    Run it after changing `min_xp` or `thresholds` to apply them to the past; nothing is fetched from duome.eu.
 
-    # The Exist API supports batching, thankfully.
-    tags = []
+    :param cfg: `dict` w/ a parsed and merged config
+    :param state: Optional `StateStore`. See `_tag_history()`
+    :return: `dict` of user -> `None` if the tagging worked or the exception that was raised
+    """
+    users = _get_users(cfg) or {cfg['duolingo']['username']: cfg}
 
-    # Now, go through each session to figure out if the user earned enough XP on that day
     days = {}
-    for record in sessions:
-        _x = sessions[record]
-        _day = record.strftime('%Y-%m-%d')
-        days.setdefault(_day, 0)
-        days[_day] += _x
+    for name, _cfg in users.items():
+        _log = _history_log(_cfg)
+        if _log is None:
+            log.warning("user:{} has no history_dir; skipping".format(name))
+            continue
+        days[name] = _log.read(_user_tz(_cfg['duolingo'])).totals()
 
-    # Now that we have a cumulative XP per day, see if sum is above our threshold
-    for day, xp in days.items():
-        if xp >= int(_duo_cfg['min_xp']):
-            log.info("on {}, you managed to practice enough ({} XPs)!".format(day, xp))
-            tags.append(_do_exist_tag_update_payload(day, tag=_exist_cfg['tag']))
+    return _tag_history(users, days, state=state)
 
-    # At this point, we should have an array of objects.
-    log.debug("Applying tag to {} days".format(len(tags)))
-    try:
-        do_exist_tag_update(tags, api_token=_exist_cfg['api_token'])
-    except Exception as e:
-        log.error("Unable to update exist.io. error: {}".format(e))
-        exit(1)
+
+def export_history(cfg=None, path='', sessions=False):
+    """
+    Writes every user's XP history log out for spreadsheets and dashboards. The format depends on the extension of
+    `path`: `.csv`, `.jsonl` (one object per line) or `.json` (one list).
+
+    :param cfg: `dict` w/ a parsed and merged config
+    :param path: The file to write
+    :param sessions: If set, one row per session w/ `user`, `when` (local to the user) and `xp`; the same columns that
+        `--backfill` reads. Otherwise, one row per day w/ `user`, `day`, `xp` and the `tags` that the day earns
+    :return: The number of rows written
+    """
+    _ext = os.path.splitext(path)[1].lower()
+    if _ext not in ('.csv', '.jsonl', '.json'):
+        _e = "Can only export to .csv, .jsonl or .json files. Got:`{}`".format(path)
+        raise ValueError(_e)
+
+    users = _get_users(cfg) or {cfg['duolingo']['username']: cfg}
+    _fields = ('user', 'when', 'xp') if sessions else ('user', 'day', 'xp', 'tags')
+
+    def _rows():
+        for name, _cfg in sorted(users.items()):
+            _log = _history_log(_cfg)
+            if _log is None:
+                continue
+            _columns = _log.read(_user_tz(_cfg['duolingo']))
+
+            if sessions:
+                for local, xp in zip(_columns.local, _columns.xp):
+                    _secs = local % 86400
+                    yield {'user': name, 'xp': xp, 'when': "{} {:02d}:{:02d}:{:02d}".format(
+                        _day_str(local // 86400), _secs // 3600, (_secs % 3600) // 60, _secs % 60)}
+                continue
+
+            thresholds = _get_thresholds(_cfg)
+            for day, xp in sorted(_columns.day_totals().items()):
+                yield {'user': name, 'day': _day_str(day), 'xp': xp,
+                       'tags': [tag for min_xp, tag in thresholds if xp >= min_xp]}
+
+    n = 0
+    with open(path, 'w', newline='') as f:
+        if _ext == '.csv':
+            _writer = csv.DictWriter(f, fieldnames=_fields)
+            _writer.writeheader()
+            for row in _rows():
+                if 'tags' in row:
+                    row['tags'] = ' '.join(row['tags'])
+                _writer.writerow(row)
+                n += 1
+        elif _ext == '.jsonl':
+            for row in _rows():
+                f.write(json.dumps(row) + '\n')
+                n += 1
+        else:
+            _all = list(_rows())
+            json.dump(_all, f, indent=1)
+            n = len(_all)
+
+    log.info("Exported {} rows to {}".format(n, path))
+    return n
 
 
 def _do_exist_tag_update_payload(when, tag=''):
@@ -354,13 +3732,127 @@ def _do_exist_tag_update_payload(when, tag=''):
     }
 
 
-def do_exist_tag_update(tags=None, api_token=''):
+class _TokenBucket(object):
+    """
+    A simple, thread safe token bucket. Every request to a rate limited API takes a token; tokens come back at `rate`
+    per second up to `capacity`. One bucket is shared by every account so that syncing many users at once doesn't
+    trip the API's limits.
+    """
+
+    def __init__(self, rate=1.0, capacity=1):
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and then takes it.
+        """
+        while True:
+            with self._lock:
+                _now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (_now - self._last) * self._rate)
+                self._last = _now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                _wait = (1 - self._tokens) / self._rate
+
+            time.sleep(_wait)
+
+
+# Every request to exist.io takes a token from here
+_EXIST_RATE_LIMITER = _TokenBucket(rate=EXIST_RATE_LIMIT, capacity=EXIST_RATE_BURST)
+
+
+def _retry_delay(attempt=0, resp=None):
+    """
+    How long to wait before trying again. If the server sent a `Retry-After` (in seconds or as a date) that is
+    honoured, otherwise the delay doubles w/ each attempt. Either way, there's some jitter so that many workers that
+    failed at the same time don't all come back at the same time.
+
+    :param attempt: How many attempts have already failed, less one
+    :param resp: The `requests.Response` that failed, if there was one
+    :return: Seconds to wait
+    """
+    _retry_after = resp.headers.get('Retry-After') if resp is not None else None
+    if _retry_after:
+        try:
+            _delay = float(_retry_after)
+        except ValueError:
+            try:
+                import email.utils
+                _when = email.utils.parsedate_to_datetime(_retry_after)
+                _delay = (_when - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                _delay = None
+
+        if _delay is not None:
+            return min(max(_delay, 0), EXIST_MAX_BACKOFF)
+
+    _delay = EXIST_BACKOFF_BASE * (2 ** attempt)
+    return min(_delay + random.uniform(0, _delay / 2), EXIST_MAX_BACKOFF)
+
+
+def _exist_post(url='', payload=None, headers=None, metrics=None):
+    """
+    POSTs `payload` to exist.io, retrying on connection errors, timeouts, 429s and 5xxs.
+
+    :param url: The API endpoint
+    :param payload: Python object to send as JSON
+    :param headers: `dict` of headers
+    :param metrics: Optional `SyncMetrics` to count requests and retries in
+    :return: The successful `requests.Response`
+    :raises requests.RequestException: if the request could not be made to work in `EXIST_MAX_RETRIES` retries, or if
+        exist.io said that there is something wrong w/ the request itself (other 4xx)
+    """
+    import requests
+    _d = json.dumps(payload)
+    _session = _get_http_session('exist.io')
+
+    for attempt in range(EXIST_MAX_RETRIES + 1):
+        _EXIST_RATE_LIMITER.acquire()
+        _count(metrics, 'exist_requests')
+
+        resp = None
+        try:
+            resp = _session.post(url, data=_d, headers=headers, timeout=EXIST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == EXIST_MAX_RETRIES:
+                raise
+            _why = e
+        else:
+            # Only "slow down" and "our fault" are worth trying again; anything else is final
+            if resp.status_code != 429 and resp.status_code < 500:
+                resp.raise_for_status()
+                return resp
+            if attempt == EXIST_MAX_RETRIES:
+                resp.raise_for_status()
+            _why = "HTTP {}".format(resp.status_code)
+
+        _delay = _retry_delay(attempt, resp)
+        log.warning("exist.io request failed (%s), retry %s of %s in %.1fs", _why, attempt + 1, EXIST_MAX_RETRIES,
+                    _delay)
+        _count(metrics, 'retries')
+        time.sleep(_delay)
+
+
+def do_exist_tag_update(tags=None, api_token='', batch_size=EXIST_BATCH_SIZE, metrics=None):
     """
     Takes a list of tags/dates + API token and then applies them to the account in question.
 
+    Tags are sent in batches of at most `batch_size`. Each batch is retried on its own (see `_exist_post()`) so a
+    transient error only costs the batch it happened to, and a batch that can't be sent doesn't stop the rest.
+    exist.io reports success/failure per tag; that is passed back to the caller.
+
     :param tags: List of tags+dates to apply to a given exist account
     :param api_token: The API token for the exist account in question
-    :return:
+    :param batch_size: The max number of tags per request
+    :param metrics: Optional `SyncMetrics` to count requests and retries in
+    :return: `dict` w/ `success` and `failed` lists of tags. Failed tags have an `error`
     """
 
     if tags is None:
@@ -378,12 +3870,31 @@ def do_exist_tag_update(tags=None, api_token=''):
         'authorization': "Bearer {}".format(api_token)
     }
 
-    # We need the Python tags object to be JSON format for the API
-    _d = json.dumps(tags)
-    resp = requests.post("https://exist.io/api/1/attributes/custom/append/", data=_d, headers=headers)
+    import requests
+    results = {'success': [], 'failed': []}
+    for i in range(0, len(tags), batch_size):
+        _batch = tags[i:i + batch_size]
 
-    # If we didn't get a 200, make noise (will raise HTTPerror)
-    resp.raise_for_status()
+        try:
+            resp = _exist_post(EXIST_APPEND_URL, _batch, headers, metrics=metrics)
+        except requests.RequestException as e:
+            log.error("Unable to send {} tags to exist.io. error: {}".format(len(_batch), e))
+            results['failed'].extend(dict(tag, error=str(e)) for tag in _batch)
+            continue
+
+        # exist.io tells us which of the tags in the batch worked; if it doesn't, assume that they all did
+        try:
+            _body = resp.json()
+        except ValueError:
+            _body = {}
+        _failed = _body.get('failed') or []
+        results['failed'].extend(_failed)
+        results['success'].extend(_body.get('success', [tag for tag in _batch if tag not in _failed]))
+
+        for tag in _failed:
+            log.warning("exist.io did not accept tag:{}".format(tag))
+
+    return results
 
 
 def parse_args():
@@ -430,6 +3941,129 @@ def parse_args():
                              "document "
                         )
 
+    parser.add_argument("--ssm-users-path",
+                        default='',
+                        type=str,
+                        help="Path prefix in the SSM Parameter Store w/ one configuration document per user (or a "
+                             "local directory of <user>.json files). Does not need --use-ssm"
+                        )
+
+    parser.add_argument("--workers",
+                        default=DEFAULT_MAX_WORKERS,
+                        type=int,
+                        help="When more than one user is configured, the max number of users to sync at the same time"
+                        )
+
+    parser.add_argument("--metrics-file",
+                        default='',
+                        type=str,
+                        help="Write per-user timings and counters to this file after the run. Files ending in .prom "
+                             "use the Prometheus text format, anything else is JSON"
+                        )
+
+    parser.add_argument("--async",
+                        dest='use_async',
+                        action='store_true',
+                        help="Sync users w/ an async pipeline of fetch/parse/post stages instead of a thread per user"
+                        )
+
+    parser.add_argument("--in-flight",
+                        default=ASYNC_MAX_IN_FLIGHT,
+                        type=int,
+                        help="With --async, the max number of requests waiting on a response at once"
+                        )
+
+    parser.add_argument("--host-limit",
+                        default=ASYNC_HOST_LIMIT,
+                        type=int,
+                        help="With --async, the max number of requests to any one host at once"
+                        )
+
+    parser.add_argument("--parse-procs",
+                        default=0,
+                        type=int,
+                        help="With --async, parse pages in this many worker processes instead of a thread"
+                        )
+
+    parser.add_argument("--daemon",
+                        action='store_true',
+                        help="Keep running and poll every configured user on an adaptive schedule instead of syncing "
+                             "once and exiting"
+                        )
+
+    parser.add_argument("--serve",
+                        default='',
+                        metavar='[HOST:]PORT',
+                        help="Keep running and sync a user whenever `POST /sync/<user>` is sent to this address. Set "
+                             "D2E_SERVE_TOKEN to require `Authorization: Bearer <token>`"
+                        )
+
+    parser.add_argument("--backfill",
+                        nargs='+',
+                        metavar='FILE',
+                        help="Instead of syncing, import the practice history in FILE (csv, jsonl or saved duome.eu "
+                             "pages) and tag every day in it that meets min_xp"
+                        )
+
+    parser.add_argument("--backfill-user",
+                        default='',
+                        type=str,
+                        help="When more than one user is configured, the user that history w/o a `user` belongs to"
+                        )
+
+    parser.add_argument("--history",
+                        choices=('report', 'retag'),
+                        help="Instead of syncing, work from each user's XP history log (see history_dir): `report` "
+                             "prints days, XP, streaks and tagged days per user; `retag` tags every day in it that "
+                             "meets the current thresholds"
+                        )
+
+    parser.add_argument("--export",
+                        default='',
+                        metavar='FILE',
+                        help="Instead of syncing, write the XP history logs to FILE (.csv, .jsonl or .json), one row "
+                             "per day"
+                        )
+
+    parser.add_argument("--export-sessions",
+                        action='store_true',
+                        help="With --export, write one row per session instead; the result can be read by --backfill"
+                        )
+
+    parser.add_argument("--record",
+                        default='',
+                        metavar='CASSETTE',
+                        help="Write every HTTP request and its response, w/ timings, to this file (JSON lines) so that"
+                             " the run can be replayed w/ --replay"
+                        )
+
+    parser.add_argument("--replay",
+                        default='',
+                        metavar='CASSETTE',
+                        help="Don't touch the network; answer every HTTP request from a file made w/ --record. The "
+                             "state store, cookie cache and history logs are not used"
+                        )
+
+    parser.add_argument("--replay-speed",
+                        default=DEFAULT_REPLAY_SPEED,
+                        type=float,
+                        help="With --replay, how many times faster than recorded responses come back. 0 answers at "
+                             "once"
+                        )
+
+    parser.add_argument("--profile",
+                        default='',
+                        metavar='FILE',
+                        help="Write cProfile stats of the sync to this file; read them w/ `python -m pstats FILE`"
+                        )
+
+    parser.add_argument("--trace-malloc",
+                        default=0,
+                        type=int,
+                        metavar='N',
+                        help="Log the peak memory use of the sync and the N lines that allocated the most"
+                        )
+
     parser.add_argument("--iam-profile",
                         default='default',
                         type=str,
@@ -457,8 +4091,11 @@ def lambda_entry(event, context):
     (memory limits, ARNs... etc)
     See: https://docs.aws.amazon.com/lambda/latest/dg//python-context-object.html
 
+    A big batch of learners can be spread over many invocations. Each one syncs only the learners named in the
+    event's `users` list and/or those in shard `shard_index` of `shard_count` (see `_shard_of()`). Learners are only
+    started while there's time left in the invocation; the rest are returned as `deferred` for the next run.
 
-    :return:
+    :return: `dict` w/ the names of the users that were `synced`, `deferred` and, w/ their errors, `failed`
     """
     log.debug("Alive!")
 
@@ -470,18 +4107,65 @@ def lambda_entry(event, context):
 
     # Check if the SSM path is set, otherwise use the default
     _c = {
-        'ssm_path': DEFAULT_SSM_PATH
+        'ssm_path': DEFAULT_SSM_PATH,
+        'cfg_ttl': DEFAULT_CFG_TTL
     }
     if 'ssm_path' in event:
         _c['ssm_path'] = event['ssm_path']
+    if 'cfg_ttl' in event:
+        _c['cfg_ttl'] = event['cfg_ttl']
+    if 'ssm_users_path' in event:
+        _c['ssm_users_path'] = event['ssm_users_path']
+
+    # Config is cached between warm invocations; the event can ask for a fresh copy
+    if event.get('invalidate_cache', False):
+        invalidate_cfg_cache(_c['ssm_path'])
+
+    # Per-user timings/counters are logged as JSON when asked for
+    _metrics = {} if event.get('metrics', False) else None
+
+    # The async pipeline keeps many more requests in flight from the one (small) lambda
+    _pipeline = None
+    if event.get('async', False):
+        _pipeline = {'in_flight': event.get('in_flight', ASYNC_MAX_IN_FLIGHT),
+                     'host_limit': event.get('host_limit', ASYNC_HOST_LIMIT)}
+
+    _cfg = load_cfg(_c)
+    if any(k in event for k in ('users', 'shard_index', 'shard_count')):
+        _cfg = _select_users(_cfg, names=event.get('users'), shard_index=event.get('shard_index'),
+                             shard_count=event.get('shard_count'))
+        log.info("Selected {} users".format(len(_cfg['users'])))
+        if len(_cfg['users']) < 1:
+            return {'synced': [], 'failed': {}, 'deferred': []}
+
+    # Leave enough time to wrap up once the last user is done
+    _deadline = None
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        _deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - LAMBDA_TIME_RESERVE
 
     log.info("Jumping into function...")
     # Pass the args obj off to the bulk of the code
-    do_needful(generate_cfg(_c))
+    _results = {}
+    _run(_cfg, max_workers=event.get('workers', DEFAULT_MAX_WORKERS), metrics=_metrics, pipeline=_pipeline,
+         deadline=_deadline, results=_results)
+    if _metrics is not None:
+        _log_metrics(_metrics)
+
+    report = {
+        'synced': sorted(name for name, e in _results.items() if e is None),
+        'failed': {name: str(e) for name, e in sorted(_results.items())
+                   if e is not None and not isinstance(e, DeferredError)},
+        'deferred': sorted(name for name, e in _results.items() if isinstance(e, DeferredError))
+    }
+    if report['deferred']:
+        log.warning("{} users were deferred to the next run".format(len(report['deferred'])))
+    if report['failed'] or not _results:
+        raise RuntimeError("One or more users could not be synced: {}".format(json.dumps(report)))
 
-    # Assuming that nothing blew up, exit cleanly :)
+    # Assuming that nothing blew up, return cleanly :)
+    #   Don't `exit()`; that would throw away the warm container along w/ everything that we've cached in it.
     log.info("Exiting...")
-    exit(0)
+    return report
 
 
 def generate_cfg(args=None):
@@ -511,17 +4195,21 @@ def generate_cfg(args=None):
             log.debug("... Fetching SSM")
             _do_deep_merge(_cfg, _get_params_from_ssm(path=args.ssm_path, iam_profile=args.iam_profile))
 
+        # Per-user documents can come from SSM or, for local testing, a directory of JSON files
+        if args.ssm_users_path != '':
+            log.debug("... Fetching users from %s", args.ssm_users_path)
+            _merge_users_by_path(_cfg, path=args.ssm_users_path, iam_profile=args.iam_profile)
+
         # Check if `api_token` is commented out *or* empty. If yes, load `D2E_API_TOKEN`
+        #   When many users are configured, `[exist.io]` is only there for shared defaults and may be missing.
         log.debug("parse api_token...")
+        _cfg.setdefault('exist.io', {})
         if 'api_token' not in _cfg['exist.io']:
             _cfg['exist.io']['api_token'] = os.environ.get('D2E_API_TOKEN')
         elif  _cfg['exist.io']['api_token'] == '':
             _cfg['exist.io']['api_token'] = os.environ.get('D2E_API_TOKEN')
 
-        # In any event, we _should_ have a non None value for _cfg['exist.io']['api_token']. Ensure this is the case!
-        if _cfg['exist.io']['api_token'] is None:
-            log.error("Didn't get a valid api_token. Check your config.ini and env-vars")
-            exit(1)
+        # Whether every user ended up w/ a token is checked, along w/ everything else, by `compile_cfg()`
 
     elif type(args) is dict:
         # Argparse was not used, so assume that caller has set their own SSM path
@@ -530,12 +4218,13 @@ def generate_cfg(args=None):
         # When running in lambda, only the path to the SSM store needs to be set; the lambda runtime will already
         #   (read: automatically) have an IAM profile that can be applied :).
         ##
-        _do_deep_merge(_cfg, _get_params_from_ssm(path=args['ssm_path']))
+        _do_deep_merge(_cfg, _get_cached_cfg(args['ssm_path'], ttl=args.get('cfg_ttl', 0),
+                                             users_path=args.get('ssm_users_path', '')))
 
     else:
         _e = "Invalid args. Can't generate a config! got:{}" .format(args)
         log.fatal(_e)
-        exit(1)
+        raise ConfigError(_e)
 
     return _cfg
 
@@ -580,8 +4269,67 @@ if __name__ == "__main__":
     log.info("Alive. Adjusting log level to {}..".format(args.log_level))
     log.setLevel(log_levels[args.log_level])
 
+    # Build and check the whole config before doing anything w/ it
+    try:
+        _cfg = load_cfg(args)
+    except ConfigError as e:
+        log.fatal(e)
+        exit(1)
+
+    # Record or replay every HTTP request made from here on
+    _transport = None
+    if args.record != '' and args.replay != '':
+        log.fatal("--record and --replay can't be used together")
+        exit(1)
+    if args.record != '':
+        _transport = CassetteRecorder(args.record)
+        _cfg = _cassette_cfg(_cfg)
+    elif args.replay != '':
+        _transport = CassetteReplayer(args.replay, speed=args.replay_speed)
+        _cfg = _cassette_cfg(_cfg, replay=True)
+    if _transport is not None:
+        set_transport(_transport)
+        atexit.register(_transport.close)
+
     # Pass the args obj off to the bulk of the code
-    do_needful(generate_cfg(args))
+    if args.backfill:
+        _state = _open_state(_cfg)
+        try:
+            _results = do_backfill(_cfg, paths=args.backfill, default_user=args.backfill_user, state=_state)
+        finally:
+            if _state is not None:
+                _state.close()
+        if any(e is not None for e in _results.values()):
+            exit(1)
+    elif args.history == 'report':
+        print(json.dumps(history_report(_cfg), indent=1))
+    elif args.history == 'retag':
+        _state = _open_state(_cfg)
+        try:
+            _results = do_retag(_cfg, state=_state)
+        finally:
+            if _state is not None:
+                _state.close()
+        if any(e is not None for e in _results.values()):
+            exit(1)
+    elif args.export:
+        export_history(_cfg, args.export, sessions=args.export_sessions)
+    elif args.daemon:
+        run_daemon(_cfg, max_workers=args.workers, watcher=_ConfigWatcher(args))
+    elif args.serve:
+        run_server(_cfg, address=_parse_address(args.serve), watcher=_ConfigWatcher(args),
+                   token=os.environ.get('D2E_SERVE_TOKEN', ''))
+    else:
+        _metrics = {} if args.metrics_file != '' else None
+        _pipeline = None
+        if args.use_async:
+            _pipeline = {'in_flight': args.in_flight, 'host_limit': args.host_limit, 'parse_procs': args.parse_procs}
+        with _profiling(args.profile, malloc_top=args.trace_malloc):
+            _ok = _run(_cfg, max_workers=args.workers, metrics=_metrics, pipeline=_pipeline)
+        if _metrics is not None:
+            write_metrics(_metrics, args.metrics_file)
+        if not _ok:
+            exit(1)
 
     # Assuming that nothing blew up, exit cleanly :)
     log.info("Exiting...")
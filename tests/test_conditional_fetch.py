@@ -0,0 +1,76 @@
+##
+# A page that duome.eu says hasn't changed (304) must still be tagged again when the thresholds have changed.
+#
+# Run from the root of the repo:
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+# main.py lives one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import main
+
+RECENT = ['2019-12-20 10:00:00 · 30XP', '2019-12-21 10:00:00 · 60XP']
+
+
+def _cfg(thresholds=''):
+    return main.compile_cfg({
+        'duolingo': {'url': 'http://duome.invalid/{username}', 'username': 'alice', 'timezone': 'UTC',
+                     'min_xp': '10'},
+        'exist.io': {'api_token': 'token', 'tag': 'practice', 'thresholds': thresholds}
+    })
+
+
+class ConditionalFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = main.StateStore(':memory:')
+        self.sent = []
+        self.validators = []
+
+    def tearDown(self):
+        self.state.close()
+
+    def _fetch_page(self, url='', page=None, **_):
+        # Like duome.eu w/ an unchanged page: a 304 whenever a validator is sent
+        self.validators.append(page.get('etag'))
+        if page.get('etag'):
+            page['not_modified'] = True
+            return None
+        page.update(etag='"v1"', last_modified=None, not_modified=False)
+        return list(RECENT)
+
+    def _tag_update(self, tags=None, **_):
+        self.sent.append(sorted((tag['date'], tag['value']) for tag in tags))
+        return {'success': list(tags), 'failed': []}
+
+    def _sync(self, cfg):
+        with mock.patch.object(main, 'fetch_page', self._fetch_page), \
+                mock.patch.object(main, 'do_exist_tag_update', self._tag_update):
+            return main.sync_user(cfg, state=self.state)
+
+    def test_unchanged_page_is_skipped(self):
+        self._sync(_cfg('10:practice'))
+        self._sync(_cfg('10:practice'))
+        self.assertEqual(self.validators, [None, '"v1"'])
+        self.assertEqual(self.sent, [[('2019-12-20', 'practice'), ('2019-12-21', 'practice')]])
+
+    def test_new_threshold_is_applied_to_unchanged_page(self):
+        self._sync(_cfg('10:practice'))
+        self._sync(_cfg('10:practice,50:grind'))
+
+        # No validators w/ the new thresholds, so no 304; only the day w/ enough XP gets the new tag
+        self.assertEqual(self.validators, [None, None])
+        self.assertEqual(self.sent[-1], [('2019-12-21', 'grind')])
+
+        # Once that's done, the page is skipped again
+        self._sync(_cfg('10:practice,50:grind'))
+        self.assertEqual(self.validators[-1], '"v1"')
+        self.assertEqual(len(self.sent), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+##
+# A profile page w/o the raw XP block only means that the shared duome.eu session lost its timezone when the page asks
+#   for one; anything else (E.G.: a mistyped username) must leave the session alone.
+#
+# Run from the root of the repo:
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+# main.py lives one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import main
+
+PROFILE = ('<html><body><div class="hidden" id="raw"><ul>\n'
+           '<li>2019-12-20 10:00:00 &middot; 30XP</li>\n'
+           '</ul></div></body></html>')
+NO_USER = '<html><body>No such user</body></html>'
+NO_TZ = '<html><body>Please set your timezone</body></html>'
+
+
+class _Response:
+
+    def __init__(self, text=''):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.status_code = 200
+        self.ok = True
+        self.cookies = {}
+        self.headers = {}
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+
+class _Session:
+
+    def __init__(self):
+        self.cookies = {main.DUOME_MAGIC_COOKIE: 'sid'}
+
+
+class SessionReprimeTest(unittest.TestCase):
+
+    def setUp(self):
+        main._NEGATIVE_CACHE.clear()
+        self.primed = []
+        self.pages = []
+
+    def _get_duome_session(self, stale=None, **_):
+        self.primed.append(stale)
+        return _Session(), stale is not None
+
+    def _fetch(self, url=''):
+        with mock.patch.object(main, '_get_duome_session', self._get_duome_session), \
+                mock.patch.object(main, '_guarded_get', lambda s, u, **_: _Response(self.pages.pop(0))):
+            return main.fetch_page(url, gmt_delta='+0200', stream=False)
+
+    def test_missing_user_leaves_session_alone(self):
+        self.pages = [NO_USER]
+        self.assertIsNone(self._fetch('http://duome.invalid/nobody'))
+        self.assertEqual(len(self.primed), 1)
+
+        # ... and duome.eu isn't asked again for a while
+        self.assertIsNone(self._fetch('http://duome.invalid/nobody'))
+        self.assertEqual(self.pages, [])
+
+    def test_lost_timezone_primes_session_again(self):
+        self.pages = [NO_TZ, PROFILE]
+        self.assertEqual(self._fetch('http://duome.invalid/alice'), ['2019-12-20 10:00:00 · 30XP'])
+        self.assertEqual(len(self.primed), 2)
+
+    def test_timezone_that_wont_stick_is_an_error(self):
+        self.pages = [NO_TZ, NO_TZ]
+        with self.assertRaises(main.DuomeParseError):
+            self._fetch('http://duome.invalid/alice')
+        self.assertIsNone(main._negative_get('http://duome.invalid/alice'))
+
+
+if __name__ == '__main__':
+    unittest.main()